@@ -28,13 +28,18 @@ const arrayForWordSize = (ws: number, n: number) => {
 };
 """
 import os
+import json
 import uuid
 import numpy as np
 import logging
+import tempfile
 
 from PIL import Image
-from collections import defaultdict
-from itertools import groupby
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+
+from label_studio_converter.imports.colors import COLORS
 
 logger = logging.getLogger(__name__)
 
@@ -65,13 +70,31 @@ def bytes2bit(data):
     return ''.join([str(access_bit(data, i)) for i in range(len(data) * 8)])
 
 
-def decode_rle(rle, print_params: bool = False):
-    """from LS RLE to numpy uint8 3d image [width, height, channel]
+class BitReader:
+    """Read MSB first bit fields of up to 57 bits using 64 bit windows of the data"""
 
-    Args:
-        print_params (bool, optional): If true, a RLE parameters print statement is suppressed
+    def __init__(self, data):
+        self.data = np.asarray(data, dtype=np.uint8).tobytes()
+        self.size = len(self.data) * 8
+        self.data += bytes(8)  # the last window can start at the last byte
+        self.i = 0
+
+    def read(self, size):
+        start = self.i >> 3
+        window = int.from_bytes(self.data[start : start + 8], 'big')
+        self.i += size
+        return (window >> (64 - (self.i - (start << 3)))) & ((1 << size) - 1)
+
+
+def decode_rle_runs(rle, print_params: bool = False):
+    """from LS RLE to runs of equal values
+
+    Records depend on the previous ones, so only their headers are parsed in a loop,
+    then values of all series and literal records are read at once from np.unpackbits() bits.
+
+    :return: tuple (uint8 values, int64 run lengths), lengths sum up to the number of values
     """
-    input = InputStream(bytes2bit(rle))
+    input = BitReader(rle)
     num = input.read(32)
     word_size = input.read(5) + 1
     rle_sizes = [input.read(4) + 1 for _ in range(4)]
@@ -81,26 +104,181 @@ def decode_rle(rle, print_params: bool = False):
             'RLE params:', num, 'values', word_size, 'word_size', rle_sizes, 'rle_sizes'
         )
 
+    # record header (series bit, rle size index and length) is read
+    # from one 64 bit window, it takes at most 3 + 16 bits
+    data, size, pos = input.data, input.size, input.i
+    from_bytes = int.from_bytes
+    starts, counts, series = [], [], []
     i = 0
-    out = np.zeros(num, dtype=np.uint8)
     while i < num:
-        x = input.read(1)
-        j = i + 1 + input.read(rle_sizes[input.read(2)])
-        if x:
-            val = input.read(word_size)
-            out[i:j] = val
-            i = j
-        else:
-            while i < j:
-                val = input.read(word_size)
-                out[i] = val
-                i += 1
-    return out
+        if pos >= size:
+            raise ValueError('RLE data is truncated')
+        start = pos >> 3
+        window = from_bytes(data[start : start + 8], 'big')
+        shift = 61 - (pos - (start << 3))
+        head = (window >> shift) & 7
+        rle_size = rle_sizes[head & 3]
+        shift -= rle_size
+        n = ((window >> shift) & ((1 << rle_size) - 1)) + 1
+        pos += 3 + rle_size
+        starts.append(pos)
+        counts.append(n)
+        series.append(head >> 2)
+        # a series has one value, a literal record has n values
+        pos += word_size if head & 4 else n * word_size
+        i += n
+
+    starts = np.array(starts, dtype=np.int64)
+    counts = np.array(counts, dtype=np.int64)
+    series = np.array(series, dtype=bool)
+    words = np.where(series, 1, counts)
+    # bit position of every value
+    offsets = np.arange(words.sum()) - np.repeat(np.cumsum(words) - words, words)
+    positions = np.repeat(starts, words) + offsets * word_size
+    # values past the end of the data are read from zero padding
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    bits = np.concatenate([bits, np.zeros(word_size, dtype=np.uint8)])
+    positions = np.minimum(positions, len(bits) - word_size)
+    values = np.zeros(len(positions), dtype=np.int64)
+    for k in range(word_size):
+        values = (values << 1) | bits[positions + k]
+
+    values = values.astype(np.uint8)
+    lengths = np.where(np.repeat(series, words), np.repeat(counts, words), 1)
+    if i > num:
+        # the last series can go past the end
+        lengths[-1] -= i - num
+    return values, lengths
 
 
-def decode_from_annotation(from_name, results):
-    """from LS annotation to {"tag_name + label_name": [numpy uint8 image (width x height)]}"""
-    layers = {}
+def decode_rle(rle, print_params: bool = False):
+    """from LS RLE to numpy uint8 3d image [width, height, channel]
+
+    Args:
+        print_params (bool, optional): If true, a RLE parameters print statement is suppressed
+    """
+    values, lengths = decode_rle_runs(rle, print_params)
+    return np.repeat(values, lengths)
+
+
+def _channel_runs(values, lengths, channel, channels):
+    """Convert runs over interleaved channel values to runs over pixels of one channel
+
+    :return: tuple (values, pixel run lengths, pixel run ends)
+    """
+    ends = np.cumsum(lengths)
+    # pixel p has its channel value at p * channels + channel,
+    # so (end + channels - 1 - channel) // channels pixels lie before the run end
+    pixel_ends = (ends + (channels - 1 - channel)) // channels
+    pixel_lengths = np.diff(pixel_ends, prepend=0)
+    return values, pixel_lengths, pixel_ends
+
+
+def decode_rle_channel(rle, channel=3, channels=4):
+    """from LS RLE to one channel of the image without decoding the others
+
+    :param rle: LS RLE
+    :param channel: channel index, 3 is alpha in RGBA
+    :param channels: number of interleaved channels
+    :return: numpy uint8 1d array with a value per pixel
+    """
+    values, lengths, _ = _channel_runs(*decode_rle_runs(rle), channel, channels)
+    return np.repeat(values, lengths)
+
+
+def rle2coco(rle, width, height, image_width=None, image_height=None):
+    """Convert LS RLE of a brush region to COCO uncompressed RLE
+
+    Area and bounding box are computed from the runs, the alpha channel
+    is expanded to a bit mask only to reorder runs column by column.
+    If the image size differs from the size the region was drawn on,
+    the mask is scaled to the image size with nearest neighbour sampling.
+
+    :param rle: LS RLE
+    :param width: width of the image the region was drawn on (original_width)
+    :param height: height of the image the region was drawn on (original_height)
+    :param image_width: width of the exported image, the same as width by default
+    :param image_height: height of the exported image, the same as height by default
+    :return: tuple (COCO segmentation {"counts": [...], "size": [height, width]}, area, [x, y, w, h] bbox)
+    """
+    values, lengths, ends = _channel_runs(*decode_rle_runs(rle), 3, 4)
+    if int(lengths.sum()) != width * height:
+        raise ValueError(
+            f'Brush RLE has {int(lengths.sum())} pixels, '
+            f'it does not match {width}x{height} size'
+        )
+    keep = lengths > 0
+    values, lengths, ends = values[keep], lengths[keep], ends[keep]
+    foreground = values > 0
+    mask = np.repeat(foreground, lengths).reshape(height, width)
+
+    image_width = image_width or width
+    image_height = image_height or height
+    if (image_width, image_height) != (width, height):
+        rows = np.arange(image_height) * height // image_height
+        columns = np.arange(image_width) * width // image_width
+        mask = mask[rows][:, columns]
+        area = int(mask.sum())
+        bbox = [0, 0, 0, 0]
+        if area:
+            ys = np.flatnonzero(mask.any(axis=1))
+            xs = np.flatnonzero(mask.any(axis=0))
+            bbox = [
+                int(xs[0]),
+                int(ys[0]),
+                int(xs[-1] - xs[0] + 1),
+                int(ys[-1] - ys[0] + 1),
+            ]
+    else:
+        starts = (ends - lengths)[foreground]
+        ends = ends[foreground]
+        area = int((ends - starts).sum())
+        bbox = [0, 0, 0, 0]
+        if area:
+            first_row, last_row = starts // width, (ends - 1) // width
+            # runs spanning several rows cover all columns
+            one_row = first_row == last_row
+            x0 = int(np.where(one_row, starts % width, 0).min())
+            x1 = int(np.where(one_row, (ends - 1) % width, width - 1).max())
+            y0, y1 = int(first_row.min()), int(last_row.max())
+            bbox = [x0, y0, x1 - x0 + 1, y1 - y0 + 1]
+
+    # COCO runs go column by column and start with background
+    mask = mask.T.ravel()
+    changes = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    bounds = np.concatenate([[0], changes, [mask.size]])
+    counts = np.diff(bounds).tolist()
+    if mask.size and mask[0]:
+        counts.insert(0, 0)
+    return {'counts': counts, 'size': [image_height, image_width]}, area, bbox
+
+
+def iter_rle_channel_rows(rle, width, height, rows=1024, channel=3, channels=4):
+    """Decode one channel of LS RLE by bands of rows with memory bounded by the band size
+
+    :param rle: LS RLE
+    :param width: image width
+    :param height: image height
+    :param rows: max number of rows in a band
+    :param channel: channel index, 3 is alpha in RGBA
+    :param channels: number of interleaved channels
+    :return: generator of (first row, numpy uint8 array [rows x width])
+    """
+    values, _, pixel_ends = _channel_runs(*decode_rle_runs(rle), channel, channels)
+    for row in range(0, height, rows):
+        band_rows = min(rows, height - row)
+        start, end = row * width, (row + band_rows) * width
+        # runs overlapping with the band
+        first = np.searchsorted(pixel_ends, start, side='right')
+        last = np.searchsorted(pixel_ends, end, side='left') + 1
+        ends = np.minimum(pixel_ends[first:last], end)
+        lengths = np.diff(ends, prepend=start)
+        band = np.repeat(values[first:last], lengths)
+        yield row, band.reshape(band_rows, width)
+
+
+def iter_brush_layers(from_name, results):
+    """Brush results of a control tag without decoding: generator of ("tag_name-label_name-counter", result)"""
     counters = defaultdict(int)
     for result in results:
         key = (
@@ -111,22 +289,102 @@ def decode_from_annotation(from_name, results):
         if key is None or 'rle' not in result:
             continue
 
-        rle = result['rle']
-        width = result['original_width']
-        height = result['original_height']
         labels = result[key] if key in result else ['no_label']
         name = from_name + '-' + '-'.join(labels)
 
         # result count
         i = str(counters[name])
         counters[name] += 1
-        name += '-' + i
+        yield name + '-' + i, result
 
-        image = decode_rle(rle)
-        layers[name] = np.reshape(image, [height, width, 4])[:, :, 3]
+
+def decode_from_annotation(from_name, results):
+    """from LS annotation to {"tag_name + label_name": [numpy uint8 image (width x height)]}"""
+    layers = {}
+    for name, result in iter_brush_layers(from_name, results):
+        width = result['original_width']
+        height = result['original_height']
+        image = decode_rle_channel(result['rle'])
+        layers[name] = np.reshape(image, [height, width])
     return layers
 
 
+def annotation_filename(task_id, annotation_id, completed_by):
+    """File name prefix for masks of an annotation: task-<id>-annotation-<id>-by-<email>"""
+    if isinstance(completed_by, dict):
+        email = completed_by.get('email', '')
+    else:
+        email = str(completed_by)
+    email = "".join(
+        x for x in email if x.isalnum() or x == '@' or x == '.'
+    )  # sanitize filename
+    return (
+        'task-' + str(task_id) + '-annotation-' + str(annotation_id) + '-by-' + email
+    )
+
+
+def decode_indexed_mask(output, label_ids):
+    """Composite brush layers of all control tags of an annotation into one indexed mask
+
+    :param output: {from_name: results} of an annotation
+    :param label_ids: {label name: class id}, ids start from 1, 0 is background
+    :return: numpy uint8 (or uint16 if ids don't fit) image [height x width] or None if there are no brush layers
+    """
+    dtype = np.uint8 if max(label_ids.values(), default=0) < 256 else np.uint16
+    mask = None
+    for from_name, results in output.items():
+        for result in results:
+            key = (
+                'brushlabels'
+                if result['type'].lower() == 'brushlabels'
+                else ('labels' if result['type'].lower() == 'labels' else None)
+            )
+            if key is None or 'rle' not in result:
+                continue
+            labels = result.get(key) or []
+            label_id = next((label_ids[x] for x in labels if x in label_ids), None)
+            if label_id is None:
+                logger.warning(
+                    f'Unknown labels {labels} in {from_name}, the layer is skipped'
+                )
+                continue
+
+            width, height = result['original_width'], result['original_height']
+            if mask is None:
+                mask = np.zeros((height, width), dtype=dtype)
+            # layers are painted in the order of results, the last one is on top;
+            # alpha is decoded by bands, so there is no full size copy of each layer
+            for row, alpha in iter_rle_channel_rows(result['rle'], width, height):
+                mask[row : row + len(alpha)][alpha > 0] = label_id
+    return mask
+
+
+def save_indexed_mask(image, filename, label_ids, out_format='png'):
+    """Save indexed mask as palette PNG (16 bit grayscale PNG for more than 255 labels)
+    or compressed NumPy .npz with "mask", "label_ids" and "label_names" arrays
+    """
+    if out_format == 'png':
+        im = Image.fromarray(image)
+        if image.dtype == np.uint8:
+            # L image with a palette becomes P
+            palette = [0, 0, 0] + [c for color in COLORS for c in color]
+            im.putpalette(palette[: 256 * 3])
+        save_atomic(filename + '.png', lambda f: im.save(f, format='PNG'))
+    elif out_format == 'npz':
+        names = sorted(label_ids, key=label_ids.get)
+        save_atomic(
+            filename + '.npz',
+            lambda f: np.savez_compressed(
+                f,
+                mask=image,
+                label_ids=np.array([label_ids[name] for name in names]),
+                label_names=np.array(names),
+            ),
+        )
+    else:
+        raise Exception('Unknown output format for indexed brush masks')
+
+
 def save_brush_images_from_annotation(
     task_id,
     annotation_id,
@@ -137,39 +395,64 @@ def save_brush_images_from_annotation(
     out_format='numpy',
 ):
     layers = decode_from_annotation(from_name, results)
-    if isinstance(completed_by, dict):
-        email = completed_by.get('email', '')
-    else:
-        email = str(completed_by)
-    email = "".join(
-        x for x in email if x.isalnum() or x == '@' or x == '.'
-    )  # sanitize filename
+    prefix = annotation_filename(task_id, annotation_id, completed_by)
 
     for name in layers:
-        filename = os.path.join(
-            out_dir,
-            'task-'
-            + str(task_id)
-            + '-annotation-'
-            + str(annotation_id)
-            + '-by-'
-            + email
-            + '-'
-            + name,
-        )
+        filename = os.path.join(out_dir, prefix + '-' + name)
         image = layers[name]
         logger.debug(f'Save image to {filename}')
         if out_format == 'numpy':
-            np.save(filename, image)
+            save_atomic(filename + '.npy', lambda f: np.save(f, image))
         elif out_format == 'png':
             im = Image.fromarray(image)
-            im.save(filename + '.png')
+            save_atomic(filename + '.png', lambda f: im.save(f, format='PNG'))
         else:
             raise Exception('Unknown output format for brush converter')
 
 
-def convert_task(item, out_dir, out_format='numpy'):
-    """Task with multiple annotations to brush images, out_format = numpy | png"""
+def _chmod_default(path):
+    """Give the file the mode open() would create it with: mkstemp files are owner-only (0600)"""
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(path, 0o666 & ~umask)
+
+
+def save_atomic(filename, save):
+    """Write file via temporary file and rename, so readers never see a partially written file
+
+    :param filename: output file
+    :param save: function to write the content to the opened binary file
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(filename) or '.', prefix='.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            save(f)
+        _chmod_default(tmp_path)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def convert_task(item, out_dir, out_format='numpy', label_ids=None):
+    """Task with multiple annotations to brush images, out_format = numpy | png | indexed_png | indexed_npz
+
+    indexed_* formats save one mask per annotation with label ids from label_ids {label name: id}
+    """
+    if out_format.startswith('indexed_'):
+        image = decode_indexed_mask(item['output'], label_ids)
+        if image is not None:
+            filename = os.path.join(
+                out_dir,
+                annotation_filename(
+                    item['id'], item['annotation_id'], item['completed_by']
+                ),
+            )
+            save_indexed_mask(image, filename, label_ids, out_format[len('indexed_') :])
+        return
+
     for from_name, results in item['output'].items():
         save_brush_images_from_annotation(
             item['id'],
@@ -182,10 +465,144 @@ def convert_task(item, out_dir, out_format='numpy'):
         )
 
 
-def convert_task_dir(items, out_dir, out_format='numpy'):
-    """Directory with tasks and annotation to brush images, out_format = numpy | png"""
+def convert_tasks(items, out_dir, out_format='numpy', label_ids=None):
+    """List of tasks to brush images, it's a unit of work for convert_task_dir() processes"""
     for item in items:
-        convert_task(item, out_dir, out_format)
+        convert_task(item, out_dir, out_format, label_ids)
+
+
+def convert_task_dir(
+    items, out_dir, out_format='numpy', workers=1, chunk_size=16, label_ids=None
+):
+    """Directory with tasks and annotation to brush images, out_format = numpy | png | indexed_png | indexed_npz
+
+    :param items: iterable of tasks
+    :param out_dir: output directory
+    :param out_format: numpy | png - file per layer, indexed_png | indexed_npz - file per annotation
+    :param workers: number of processes to decode and save masks, 1 converts tasks in this process
+    :param chunk_size: number of tasks sent to a process at once
+    :param label_ids: {label name: id} for indexed formats, ids start from 1, 0 is background;
+                      the map is saved to labels.json in out_dir
+    """
+    if out_format.startswith('indexed_'):
+        with open(os.path.join(out_dir, 'labels.json'), 'w') as f:
+            json.dump(label_ids, f, indent=2)
+
+    if workers <= 1:
+        convert_tasks(items, out_dir, out_format, label_ids)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # keep a bounded number of chunks in flight and check results in order,
+        # so errors are raised for the first failed chunk and items are read lazily
+        pending = deque()
+        items = iter(items)
+        for chunk in iter(lambda: list(islice(items, chunk_size)), []):
+            pending.append(
+                executor.submit(convert_tasks, chunk, out_dir, out_format, label_ids)
+            )
+            if len(pending) >= workers * 2:
+                pending.popleft().result()
+        while pending:
+            pending.popleft().result()
+
+
+# record of BRUSH_TO_MEMMAP index, the mask is masks.bin[offset : offset + height * width]
+MEMMAP_INDEX_DTYPE = np.dtype(
+    [
+        ('task_id', '<i8'),
+        ('annotation_id', '<i8'),
+        ('label', '<i4'),  # index in labels.json
+        ('offset', '<i8'),
+        ('height', '<i4'),
+        ('width', '<i4'),
+    ]
+)
+
+
+def convert_task_dir_memmap(items, out_dir, rows=1024):
+    """Tasks to one random access container of brush masks
+
+    Masks are appended as raw uint8 arrays to masks.bin, index.npy has a MEMMAP_INDEX_DTYPE
+    record per mask and labels.json has the list of "<from_name>-<labels>" layer names.
+    Masks are decoded and written by bands of rows, so large masks aren't kept in memory.
+    Use load_memmap_masks() to read them without copying.
+
+    :param rows: max number of mask rows decoded at once
+    """
+    labels = {}  # layer name => index
+    records = []
+    offset = 0
+    masks_file = os.path.join(out_dir, 'masks.bin')
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for item in items:
+                for from_name, results in item['output'].items():
+                    for name, result in iter_brush_layers(from_name, results):
+                        # strip the result counter
+                        label = labels.setdefault(name.rsplit('-', 1)[0], len(labels))
+                        width = result['original_width']
+                        height = result['original_height']
+                        for _, band in iter_rle_channel_rows(
+                            result['rle'], width, height, rows
+                        ):
+                            f.write(band.tobytes())
+                        records.append(
+                            (
+                                _int_or(item['id'], -1),
+                                _int_or(item['annotation_id'], -1),
+                                label,
+                                offset,
+                                height,
+                                width,
+                            )
+                        )
+                        offset += height * width
+        _chmod_default(tmp_path)
+        os.replace(tmp_path, masks_file)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    index = np.array(records, dtype=MEMMAP_INDEX_DTYPE)
+    save_atomic(os.path.join(out_dir, 'index.npy'), lambda f: np.save(f, index))
+    with open(os.path.join(out_dir, 'labels.json'), 'w') as f:
+        json.dump(sorted(labels, key=labels.get), f, indent=2)
+    logger.info(f'Saved {len(index)} masks, {offset} bytes to {masks_file}')
+
+
+def _int_or(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def load_memmap_masks(out_dir):
+    """Open BRUSH_TO_MEMMAP output
+
+    Example:
+        masks, index, labels = load_memmap_masks('output')
+        mask = get_memmap_mask(masks, index[0])
+
+    :return: tuple (np.memmap uint8 with all masks, index array, list of labels)
+    """
+    index = np.load(os.path.join(out_dir, 'index.npy'))
+    with open(os.path.join(out_dir, 'labels.json')) as f:
+        labels = json.load(f)
+    masks_file = os.path.join(out_dir, 'masks.bin')
+    if os.path.getsize(masks_file) == 0:
+        # empty files can't be mapped
+        return np.zeros(0, dtype=np.uint8), index, labels
+    return np.memmap(masks_file, dtype=np.uint8, mode='r'), index, labels
+
+
+def get_memmap_mask(masks, record):
+    """Get mask [height x width] of an index record from load_memmap_masks() without copying"""
+    start = int(record['offset'])
+    end = start + int(record['height']) * int(record['width'])
+    return masks[start:end].reshape(int(record['height']), int(record['width']))
 
 
 # convert_task_dir('/ls/test/completions', '/ls/test/completions/output', 'numpy')
@@ -242,103 +659,103 @@ def encode_rle(arr, wordsize=8, rle_sizes=[3, 4, 8, 16]):
     :type rle: list
 
     """
-    # Set length of array in 32 bits
-    num = len(arr)
-    numbits = f'{num:032b}'
-
-    # put in the wordsize in bits
-    wordsizebits = f'{wordsize - 1:05b}'
-
-    # put rle sizes in the bits
-    rle_bits = ''.join([f'{x - 1:04b}' for x in rle_sizes])
-
-    # combine it into base string
-    base_str = numbits + wordsizebits + rle_bits
-
-    # start with creating the rle bite string
-    out_str = ''
-    for length_reeks, p, value in zip(*base_rle_encode(arr)):
-        # TODO: A nice to have but --> this can be optimized but works
-        if length_reeks == 1:
-            # we state with the first 0 that it has a length of 1
-            out_str += '0'
-            # We state now the index on the rle sizes
-            out_str += '00'
-
-            # the rle size value is 0 for an individual number
-            out_str += '000'
-
-            # put the value in a 8 bit string
-            out_str += f'{value:08b}'
-            state = 'single_val'
-
-        elif length_reeks > 1:
-            state = 'series'
-            # rle size = 3
-            if length_reeks <= 8:
-                # Starting with a 1 indicates that we have started a series
-                out_str += '1'
-
-                # index in rle size arr
-                out_str += '00'
-
-                # length of array to bits
-                out_str += f'{length_reeks - 1:03b}'
-
-                out_str += f'{value:08b}'
-
-            # rle size = 4
-            elif 8 < length_reeks <= 16:
-                # Starting with a 1 indicates that we have started a series
-                out_str += '1'
-                out_str += '01'
-
-                # length of array to bits
-                out_str += f'{length_reeks - 1:04b}'
+    lengths, _, values = base_rle_encode(arr)
+    if lengths is None:
+        lengths = values = np.zeros(0, dtype=np.int64)
+    return runs2rle(lengths, values, wordsize, rle_sizes)
 
-                out_str += f'{value:08b}'
 
-            # rle size = 8
-            elif 16 < length_reeks <= 256:
-                # Starting with a 1 indicates that we have started a series
-                out_str += '1'
+def _pack_fields(fields, widths):
+    """Concatenate unsigned integer bit fields (MSB first) into bytes
 
-                out_str += '10'
-
-                # length of array to bits
-                out_str += f'{length_reeks - 1:08b}'
-
-                out_str += f'{value:08b}'
-
-            # rle size = 16 or longer
-            else:
-                length_temp = length_reeks
-                while length_temp > 2**16:
-                    # Starting with a 1 indicates that we have started a series
-                    out_str += '1'
-
-                    out_str += '11'
-                    out_str += f'{2 ** 16 - 1:016b}'
-
-                    out_str += f'{value:08b}'
-                    length_temp -= 2**16
-
-                # Starting with a 1 indicates that we have started a series
-                out_str += '1'
-
-                out_str += '11'
-                # length of array to bits
-                out_str += f'{length_temp - 1:016b}'
+    :param fields: np.uint64 array with field values
+    :param widths: bit width of each field, at most 64 bits
+    :return: np.uint8 array, the last byte is padded with zero bits
+    """
+    fields = np.asarray(fields, dtype=np.uint64)
+    widths = np.asarray(widths, dtype=np.int64)
+    ends = np.cumsum(widths)
+    starts = ends - widths
+    total = int(ends[-1]) if len(ends) else 0
+
+    # put each field to one or two big-endian 64 bit words,
+    # the fields don't overlap, so adding them is the same as bitwise or
+    words = np.zeros(total // 64 + 2, dtype=np.uint64)
+    word = starts // 64
+    end = starts % 64 + widths  # end of field relative to its first word, 1..128
+    spans = end > 64
+    first = np.where(
+        spans,
+        fields >> np.clip(end - 64, 0, 63).astype(np.uint64),
+        fields << np.clip(64 - end, 0, 63).astype(np.uint64),
+    )
+    np.add.at(words, word, first)
+    if spans.any():
+        second = fields[spans] << (128 - end[spans]).astype(np.uint64)
+        np.add.at(words, word[spans] + 1, second)
 
-                out_str += f'{value:08b}'
+    data = np.frombuffer(words.astype('>u8').tobytes(), dtype=np.uint8)
+    return data[: (total + 7) // 8]
 
-    # make sure that we have an 8 fold lenght otherwise add 0's at the end
-    nzfill = 8 - len(base_str + out_str) % 8
-    total_str = base_str + out_str
-    total_str = total_str + nzfill * '0'
 
-    rle = bits2byte(total_str)
+def runs2rle(lengths, values, wordsize=8, rle_sizes=[3, 4, 8, 16]):
+    """Encode runs of equal values (see base_rle_encode) to LS RLE bytes
 
+    :param lengths: run lengths, all > 0
+    :param values: run values, non-negative integers
+    :param wordsize: wordsize bits for decoding, default is 8
+    :param rle_sizes: list of ints which state how long a series is of the same number
+    :return rle: run length encoded array
+    :type rle: list
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    values = np.asarray(values)
+    if values.size and values.min() < 0:
+        raise ValueError('RLE values must be non-negative')
+    values = values.astype(np.uint64)
+    num = int(lengths.sum())
+
+    # series longer than 2**16 are split into records of 2**16 items
+    full = np.where(lengths > 256, (lengths - 1) // 2**16, 0)
+    counts = full + 1
+    run = np.repeat(np.arange(len(lengths)), counts)
+    k = np.arange(len(run)) - np.repeat(np.cumsum(counts) - counts, counts)
+    length = np.where(k == full[run], lengths[run] - full[run] * 2**16, 2**16)
+    long_run = lengths[run] > 256
+    value = values[run]
+
+    # record header: series bit, index in rle sizes, length - 1
+    # (a single value is stored as "0 00 000")
+    n = (length - 1).astype(np.uint64)
+    header = np.select(
+        [long_run, length > 16, length > 8, length > 1],
+        [(0b111 << 16) | n, (0b110 << 8) | n, (0b101 << 4) | n, (0b100 << 3) | n],
+        np.uint64(0),
+    ).astype(np.uint64)
+    header_width = np.select(
+        [long_run, length > 16, length > 8], [19, 11, 7], 6
+    ).astype(np.int64)
+
+    # values take 8 bits or more if they don't fit
+    value_width = np.full(len(value), 8, dtype=np.int64)
+    wide = value > 255
+    if wide.any():
+        value_width[wide] = [int(v).bit_length() for v in value[wide]]
+    if (header_width + value_width).max(initial=0) > 64:
+        raise ValueError('RLE values are too large')
+    records = (header << value_width.astype(np.uint64)) | value
+
+    # file header: number of values, word size, rle sizes
+    fields = np.concatenate(
+        [[num, wordsize - 1] + [x - 1 for x in rle_sizes], records]
+    ).astype(np.uint64)
+    widths = np.concatenate([[32, 5, 4, 4, 4, 4], header_width + value_width])
+
+    # at least one zero bit is appended, a full zero byte if the stream is 8 bits aligned
+    total = int(widths.sum())
+    rle = _pack_fields(fields, widths).tolist()
+    if total % 8 == 0:
+        rle.append(0)
     return rle
 
 
@@ -372,10 +789,9 @@ def mask2rle(mask):
     """
     assert len(mask.shape) == 2, 'mask must be 2D np.array'
     assert mask.dtype == np.uint8 or mask.dtype == int, 'mask must be uint8 or int'
-    array = mask.ravel()
-    array = np.repeat(array, 4)  # must be 4 channels
-    rle = encode_rle(array)
-    return rle
+    lengths, _, values = base_rle_encode(mask.ravel())
+    # the same as encode_rle(np.repeat(array, 4)), every pixel must be 4 channels
+    return runs2rle(lengths * 4, values)
 
 
 def image2rle(path):
@@ -392,9 +808,7 @@ def image2rle(path):
     """
     with Image.open(path).convert('L') as image:
         mask = np.array((np.array(image) > 128) * 255, dtype=np.uint8)
-        array = mask.ravel()
-        array = np.repeat(array, 4)
-        rle = encode_rle(array)
+        rle = mask2rle(mask)
         return rle, image.size[0], image.size[1]
 
 
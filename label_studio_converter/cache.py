@@ -0,0 +1,259 @@
+import os
+import io
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from collections import defaultdict
+
+from label_studio_converter.image_probe import probe_image
+from label_studio_converter.utils import (
+    DOWNLOAD_CHUNK_SIZE,
+    fetch_url,
+    materialize,
+    remove_partial_download,
+    verify_checksum,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCache(object):
+    """Persistent content-addressed cache for downloaded resources
+
+    Files are stored once per content hash in <cache_dir>/objects, the index
+    (url => content hash, ETag, Last-Modified) lives in <cache_dir>/index.sqlite3.
+    Cached urls are revalidated with conditional requests, so unchanged files
+    cost only a "304 Not Modified" response. The least recently used files are
+    evicted when the cache grows over `max_size` bytes.
+    """
+
+    DEFAULT_MAX_SIZE = 10 * 1024**3
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE, revalidate=True):
+        """
+        :param cache_dir: directory to keep cached files and the index in
+        :param max_size: byte budget for cached files
+        :param revalidate: if False, cached urls are served without any request to the server
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.revalidate = revalidate
+        self._objects_dir = os.path.join(cache_dir, 'objects')
+        self._partial_dir = os.path.join(cache_dir, 'partial')
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._partial_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._url_locks = defaultdict(threading.Lock)
+        # digest => number of fetches using the object, pinned objects aren't evicted
+        self._pins = defaultdict(int)
+        self._db = sqlite3.connect(
+            os.path.join(cache_dir, 'index.sqlite3'),
+            check_same_thread=False,
+            timeout=60,
+        )
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS objects '
+                '(digest TEXT PRIMARY KEY, size INTEGER, accessed REAL)'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS urls '
+                '(url TEXT PRIMARY KEY, digest TEXT, etag TEXT, last_modified TEXT)'
+            )
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects_dir, digest[:2], digest)
+
+    def _lookup(self, url, pin=False):
+        """Get (digest, etag, last_modified) of cached url, pin the object if pin is True"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest, etag, last_modified FROM urls WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None or not os.path.exists(self._object_path(row[0])):
+                return None
+            if pin:
+                self._pins[row[0]] += 1
+        return row
+
+    def _unpin(self, digest):
+        with self._lock:
+            self._pins[digest] -= 1
+            if self._pins[digest] <= 0:
+                del self._pins[digest]
+
+    def _touch(self, digest):
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE objects SET accessed = ? WHERE digest = ?',
+                (time.time(), digest),
+            )
+
+    def _store(self, url, path, headers):
+        """Move downloaded file to the objects dir and return its digest, the object is pinned"""
+        sha = hashlib.sha256()
+        with io.open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        object_path = self._object_path(digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(path, object_path)
+
+        size = os.path.getsize(object_path)
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO objects (digest, size, accessed) VALUES (?, ?, ?)',
+                (digest, size, time.time()),
+            )
+            self._db.execute(
+                'INSERT OR REPLACE INTO urls (url, digest, etag, last_modified) VALUES (?, ?, ?, ?)',
+                (url, digest, headers.get('ETag'), headers.get('Last-Modified')),
+            )
+            self._pins[digest] += 1
+        return digest
+
+    def evict(self, max_size=None):
+        """Remove least recently used files until the cache fits into max_size bytes"""
+        max_size = self.max_size if max_size is None else max_size
+        with self._lock, self._db:
+            total = self._db.execute('SELECT SUM(size) FROM objects').fetchone()[0] or 0
+            if total <= max_size:
+                return
+            rows = self._db.execute(
+                'SELECT digest, size FROM objects ORDER BY accessed'
+            ).fetchall()
+            for digest, size in rows:
+                if total <= max_size:
+                    break
+                if digest in self._pins:
+                    # another fetch is materializing it
+                    continue
+                self._db.execute('DELETE FROM objects WHERE digest = ?', (digest,))
+                self._db.execute('DELETE FROM urls WHERE digest = ?', (digest,))
+                object_path = self._object_path(digest)
+                if os.path.exists(object_path):
+                    os.remove(object_path)
+                logger.debug(f'Evict {digest} from download cache')
+                total -= size
+
+    def fetch(self, url, filepath, materialize_strategy='copy', checksum=None):
+        """Download url to filepath using the cache
+
+        :param url: http(s) url of the resource
+        :param filepath: where to put the resource
+        :param materialize_strategy: how to put the cached file to filepath, see utils.materialize();
+                                     symlinks become dangling when the file is evicted from the cache
+        :param checksum: optional "<algorithm>:<hex digest>" to verify the file
+        :return: path to the cached file
+        """
+        with self._lock:
+            url_lock = self._url_locks[url]
+        # objects are pinned from lookup to materialization,
+        # so evict() of concurrent fetches can't remove them in between
+        pinned = []
+        with url_lock:
+            try:
+                headers = {}
+                cached = self._lookup(url, pin=True)
+                if cached is not None:
+                    digest, etag, last_modified = cached
+                    pinned.append(digest)
+                    if etag:
+                        headers['If-None-Match'] = etag
+                    if last_modified:
+                        headers['If-Modified-Since'] = last_modified
+                    # without validators the file is downloaded again, content hash will dedupe it
+                    if not self.revalidate:
+                        logger.debug(f'Use cached {url}')
+                        return self._use_cached(
+                            digest, filepath, materialize_strategy, checksum
+                        )
+
+                # the partial file is named by url, so an interrupted download resumes in the next run
+                tmp_path = os.path.join(
+                    self._partial_dir, hashlib.sha256(url.encode()).hexdigest()
+                )
+                response = fetch_url(url, tmp_path, headers=headers, checksum=checksum)
+                if response.status_code == 304:
+                    remove_partial_download(tmp_path + '.part')
+                    logger.debug(f'Use cached {url}, it is not modified')
+                    return self._use_cached(
+                        digest, filepath, materialize_strategy, checksum
+                    )
+                digest = self._store(url, tmp_path, response.headers)
+                pinned.append(digest)
+                object_path = self._materialize(digest, filepath, materialize_strategy)
+            finally:
+                for pinned_digest in pinned:
+                    self._unpin(pinned_digest)
+
+        self.evict()
+        return object_path
+
+    def _use_cached(self, digest, filepath, strategy, checksum):
+        if checksum:
+            verify_checksum(self._object_path(digest), checksum)
+        self._touch(digest)
+        return self._materialize(digest, filepath, strategy)
+
+    def _materialize(self, digest, filepath, strategy):
+        object_path = self._object_path(digest)
+        materialize(object_path, filepath, strategy)
+        return object_path
+
+    def close(self):
+        self._db.close()
+
+
+class ImageMetaCache(object):
+    """Persistent cache of image width, height and channels
+
+    Entries are keyed by file path, size and modification time, so a changed
+    file is probed again. Use one SQLite file per project (e.g. next to it)
+    to skip reading images in repeated COCO, VOC and YOLO conversions.
+    """
+
+    def __init__(self, db_path):
+        """
+        :param db_path: SQLite file to keep the metadata in, it's created if missing
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=60)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, '
+                'size INTEGER, mtime INTEGER, width INTEGER, height INTEGER, channels INTEGER)'
+            )
+
+    def probe(self, image_path):
+        """Get image width, height and number of channels, see image_probe.probe_image()
+
+        :param image_path: path to image file
+        :return: tuple (width, height, channels)
+        """
+        path = os.path.abspath(image_path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT width, height, channels FROM images WHERE path = ? AND size = ? AND mtime = ?',
+                (path, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        if row is not None:
+            return tuple(row)
+
+        width, height, channels = probe_image(path)
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO images (path, size, mtime, width, height, channels) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (path, stat.st_size, stat.st_mtime_ns, width, height, channels),
+            )
+        return width, height, channels
+
+    def close(self):
+        self._db.close()
@@ -14,18 +14,22 @@ from shutil import copy2
 from enum import Enum
 from datetime import datetime
 from glob import glob
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from operator import itemgetter
 from copy import deepcopy
-from PIL import Image
 
 from label_studio_converter.exports import csv2
 
 from label_studio_converter.utils import (
     parse_config,
-    create_tokens_and_tags,
+    conll_document,
+    conll_documents,
     download,
-    get_image_size,
+    prefetch,
+    ResourceTable,
+    LocalFileIndex,
     get_image_size_and_channels,
     ensure_dir,
     get_polygon_area,
@@ -37,6 +41,7 @@ from label_studio_converter.utils import (
     convert_annotation_to_yolo_obb
 )
 from label_studio_converter import brush
+from label_studio_converter.cache import DownloadCache, ImageMetaCache
 from label_studio_converter.audio import convert_to_asr_json_manifest
 
 logger = logging.getLogger(__name__)
@@ -60,6 +65,9 @@ class Format(Enum):
     YOLO = 11
     YOLO_OBB = 12
     CSV_OLD = 13
+    BRUSH_TO_INDEXED_PNG = 14
+    BRUSH_TO_INDEXED_NPZ = 15
+    BRUSH_TO_MEMMAP = 16
 
     def __str__(self):
         return self.name
@@ -107,7 +115,7 @@ class Converter(object):
         Format.COCO: {
             'title': 'COCO',
             'description': 'Popular machine learning format used by the COCO dataset for object detection and image '
-            'segmentation tasks with polygons and rectangles.',
+            'segmentation tasks with polygons, rectangles and brush masks (RLE).',
             'link': 'https://labelstud.io/guide/export.html#COCO',
             'tags': ['image segmentation', 'object detection'],
         },
@@ -143,6 +151,27 @@ class Converter(object):
             'link': 'https://labelstud.io/guide/export.html#Brush-labels-to-NumPy-amp-PNG',
             'tags': ['image segmentation'],
         },
+        Format.BRUSH_TO_INDEXED_PNG: {
+            'title': 'Brush labels to indexed PNG',
+            'description': 'Export your brush labels as palette PNG images. Each annotation outputs as one image '
+            'with label ids as pixel values, labels.json maps label names to ids.',
+            'link': 'https://labelstud.io/guide/export.html#Brush-labels-to-NumPy-amp-PNG',
+            'tags': ['image segmentation'],
+        },
+        Format.BRUSH_TO_INDEXED_NPZ: {
+            'title': 'Brush labels to indexed NumPy',
+            'description': 'Export your brush labels as compressed NumPy .npz files. Each annotation outputs as one '
+            'array with label ids as values and the map of label names to ids.',
+            'link': 'https://labelstud.io/guide/export.html#Brush-labels-to-NumPy-amp-PNG',
+            'tags': ['image segmentation'],
+        },
+        Format.BRUSH_TO_MEMMAP: {
+            'title': 'Brush labels to memory-mapped NumPy',
+            'description': 'Export your brush labels to one raw masks.bin file with index.npy of task, annotation, '
+            'label, offset and shape for each mask, so they can be read with np.memmap without copying.',
+            'link': 'https://labelstud.io/guide/export.html#Brush-labels-to-NumPy-amp-PNG',
+            'tags': ['image segmentation'],
+        },
         Format.ASR_MANIFEST: {
             'title': 'ASR Manifest',
             'description': 'Export audio transcription labels for automatic speech recognition as the JSON manifest '
@@ -162,6 +191,14 @@ class Converter(object):
         output_tags=None,
         upload_dir=None,
         download_resources=True,
+        prefetch_size=0,
+        download_cache=None,
+        materialize_strategy='copy',
+        file_index=None,
+        image_meta_cache=None,
+        metadata_first=False,
+        workers=1,
+        tokenizer='treebank',
     ):
         """Initialize Label Studio Converter for Exports
 
@@ -170,11 +207,44 @@ class Converter(object):
         :param output_tags: it will be calculated automatically, contains label names
         :param upload_dir: upload root directory with files that were imported using LS GUI
         :param download_resources: if True, LS will try to download images, audio, etc and include them to export
+        :param prefetch_size: how many next items should have their images, audio, etc downloaded and probed
+                              in background threads while the current item is converted, 0 disables prefetching
+        :param download_cache: directory or DownloadCache instance to reuse downloaded files between exports
+        :param materialize_strategy: how to put local and cached files to the export: copy, hardlink, reflink
+                                     or symlink, the file is copied if the strategy isn't possible
+        :param file_index: LocalFileIndex or path to JSON file to persist the listing of upload dir between exports
+        :param image_meta_cache: ImageMetaCache or path to SQLite file to keep image sizes between exports
+        :param metadata_first: take image sizes for COCO from original_width and original_height of results,
+                               images are opened only when results don't have consistent sizes
+        :param workers: number of processes for CPU heavy exports (brush masks, CONLL2003)
+        :param tokenizer: tokenizer for CONLL2003 export, name from utils.SPAN_TOKENIZERS:
+                          treebank (default) or whitespace and wordpunct which are faster
         """
         self.project_dir = project_dir
         self.upload_dir = upload_dir
         self.download_resources = download_resources
+        self.prefetch_size = prefetch_size
+        if isinstance(download_cache, str):
+            download_cache = DownloadCache(download_cache)
+        self.download_cache = download_cache
+        self.materialize_strategy = materialize_strategy
+        if download_cache is not None and materialize_strategy == 'symlink':
+            logger.warning(
+                'Exported files are symlinks to the download cache, '
+                'they become dangling when the files are evicted from the cache; '
+                'use hardlink or reflink to keep them'
+            )
+        if not isinstance(file_index, LocalFileIndex):
+            file_index = LocalFileIndex(project_dir, upload_dir, index_file=file_index)
+        self.file_index = file_index
+        if isinstance(image_meta_cache, str):
+            image_meta_cache = ImageMetaCache(image_meta_cache)
+        self.image_meta_cache = image_meta_cache
+        self.metadata_first = metadata_first
+        self.workers = workers
+        self.tokenizer = tokenizer
         self._schema = None
+        self._labels = None
 
         if isinstance(config, dict):
             self._schema = config
@@ -247,14 +317,51 @@ class Converter(object):
                 if is_dir
                 else self.iter_from_json_file(input_data)
             )
-            brush.convert_task_dir(items, output_data, out_format='numpy')
+            brush.convert_task_dir(
+                items, output_data, out_format='numpy', workers=self.workers
+            )
         elif format == Format.BRUSH_TO_PNG:
             items = (
                 self.iter_from_dir(input_data)
                 if is_dir
                 else self.iter_from_json_file(input_data)
             )
-            brush.convert_task_dir(items, output_data, out_format='png')
+            brush.convert_task_dir(
+                items, output_data, out_format='png', workers=self.workers
+            )
+        elif format in (Format.BRUSH_TO_INDEXED_PNG, Format.BRUSH_TO_INDEXED_NPZ):
+            items = (
+                self.iter_from_dir(input_data)
+                if is_dir
+                else self.iter_from_json_file(input_data)
+            )
+            ensure_dir(output_data)
+            # 0 is background
+            _, category_name_to_id = self._get_labels()
+            label_ids = {
+                name: int(category_id) + 1
+                for name, category_id in category_name_to_id.items()
+            }
+            out_format = (
+                'indexed_png'
+                if format == Format.BRUSH_TO_INDEXED_PNG
+                else 'indexed_npz'
+            )
+            brush.convert_task_dir(
+                items,
+                output_data,
+                out_format=out_format,
+                workers=self.workers,
+                label_ids=label_ids,
+            )
+        elif format == Format.BRUSH_TO_MEMMAP:
+            items = (
+                self.iter_from_dir(input_data)
+                if is_dir
+                else self.iter_from_json_file(input_data)
+            )
+            ensure_dir(output_data)
+            brush.convert_task_dir_memmap(items, output_data)
         elif format == Format.ASR_MANIFEST:
             items = (
                 self.iter_from_dir(input_data)
@@ -268,8 +375,57 @@ class Converter(object):
                 project_dir=self.project_dir,
                 upload_dir=self.upload_dir,
                 download_resources=self.download_resources,
+                prefetch_size=self.prefetch_size,
+                download_cache=self.download_cache,
+                materialize_strategy=self.materialize_strategy,
+                file_index=self.file_index,
             )
 
+    def _download(self, url, output_dir):
+        return download(
+            url,
+            output_dir,
+            project_dir=self.project_dir,
+            return_relative_path=True,
+            upload_dir=self.upload_dir,
+            download_resources=self.download_resources,
+            cache=self.download_cache,
+            materialize_strategy=self.materialize_strategy,
+            file_index=self.file_index,
+        )
+
+    def _download_image(self, url, output_dir):
+        """Download image and return its path for export and the local file to read it from"""
+        image_path = self._download(url, output_dir)
+        # read uploaded and local files in place, their size and mtime don't change between exports
+        local_path = self.file_index.resolve(url) or os.path.join(
+            output_dir, os.path.basename(image_path)
+        )
+        return image_path, local_path
+
+    def _probe_image(self, image_path):
+        """Get image width, height and channels using the image metadata cache if it's set"""
+        if self.image_meta_cache is not None:
+            return self.image_meta_cache.probe(image_path)
+        return get_image_size_and_channels(image_path)
+
+    @staticmethod
+    def _image_size_from_results(item):
+        """Get (width, height) from original_width and original_height of item results,
+        None if no region has them or regions don't agree on the image size;
+        results without the size (e.g. Choices, TextArea) are skipped
+        """
+        sizes = set()
+        for labels in (item.get('output') or {}).values():
+            for label in labels:
+                width = label.get('original_width')
+                height = label.get('original_height')
+                if width and height:
+                    sizes.add((width, height))
+        if len(sizes) != 1:
+            return None
+        return sizes.pop()
+
     def _get_data_keys_and_output_tags(self, output_tags=None):
         data_keys = set()
         output_tag_names = []
@@ -306,6 +462,12 @@ class Converter(object):
                 input_tag_types.add(input_tag['type'])
 
         all_formats = [f.name for f in Format]
+        has_brush = 'Image' in input_tag_types and (
+            'BrushLabels' in output_tag_types
+            or 'brushlabels' in output_tag_types
+            or 'Brush' in output_tag_types
+            and 'Labels' in output_tag_types
+        )
         if not ('Text' in input_tag_types and 'Labels' in output_tag_types):
             all_formats.remove(Format.CONLL2003.name)
         if not (
@@ -328,19 +490,16 @@ class Converter(object):
             or 'PolygonLabels' in output_tag_types
             and 'Labels' in output_tag_types
         ):
-            all_formats.remove(Format.COCO.name)
             all_formats.remove(Format.YOLO.name)
-        if not (
-            'Image' in input_tag_types
-            and (
-                'BrushLabels' in output_tag_types
-                or 'brushlabels' in output_tag_types
-                or 'Brush' in output_tag_types
-                and 'Labels' in output_tag_types
-            )
-        ):
+            # brush regions are exported to COCO as RLE
+            if not has_brush:
+                all_formats.remove(Format.COCO.name)
+        if not has_brush:
             all_formats.remove(Format.BRUSH_TO_NUMPY.name)
             all_formats.remove(Format.BRUSH_TO_PNG.name)
+            all_formats.remove(Format.BRUSH_TO_INDEXED_PNG.name)
+            all_formats.remove(Format.BRUSH_TO_INDEXED_NPZ.name)
+            all_formats.remove(Format.BRUSH_TO_MEMMAP.name)
         if not (
             ('Audio' in input_tag_types or 'AudioPlus' in input_tag_types)
             and 'TextArea' in output_tag_types
@@ -526,43 +685,62 @@ class Converter(object):
         item_iterator = self.iter_from_dir if is_dir else self.iter_from_json_file
         return csv2.convert(item_iterator, input_data, output_dir, **kwargs)
 
-    def convert_to_conll2003(self, input_data, output_dir, is_dir=True):
+    def convert_to_conll2003(self, input_data, output_dir, is_dir=True, chunk_size=64):
+        """Export text spans to CONLL2003, documents are tokenized in self.workers processes
+
+        :param chunk_size: number of documents sent to a process at once
+        """
         self._check_format(Format.CONLL2003)
         ensure_dir(output_dir)
         output_file = os.path.join(output_dir, 'result.conll')
         data_key = self._data_keys[0]
+        item_iterator = self.iter_from_dir if is_dir else self.iter_from_json_file
+        documents = (
+            (
+                item['input'][data_key],
+                next(
+                    (
+                        result
+                        for result in item['output'].values()
+                        if result[0]['type'].lower() == 'labels'
+                    ),
+                    None,
+                ),
+            )
+            for item in item_iterator(input_data)
+        )
+
         with io.open(output_file, 'w', encoding='utf8') as fout:
             fout.write('-DOCSTART- -X- O\n')
-            item_iterator = self.iter_from_dir if is_dir else self.iter_from_json_file
-
-            for item in item_iterator(input_data):
-                filtered_output = list(
-                    filter(
-                        lambda x: x[0]['type'].lower() == 'labels',
-                        item['output'].values(),
+            if self.workers <= 1:
+                for text, spans in documents:
+                    fout.write(conll_document(text, spans, self.tokenizer))
+                return
+
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                # keep a bounded number of chunks in flight and write them in input order
+                pending = deque()
+                for chunk in iter(lambda: list(islice(documents, chunk_size)), []):
+                    pending.append(
+                        executor.submit(conll_documents, chunk, self.tokenizer)
                     )
-                )
-                tokens, tags = create_tokens_and_tags(
-                    text=item['input'][data_key],
-                    spans=next(iter(filtered_output), None),
-                )
-                for token, tag in zip(tokens, tags):
-                    fout.write('{token} -X- _ {tag}\n'.format(token=token, tag=tag))
-                fout.write('\n')
+                    if len(pending) >= self.workers * 2:
+                        fout.writelines(pending.popleft().result())
+                while pending:
+                    fout.writelines(pending.popleft().result())
 
     def convert_to_coco(
         self, input_data, output_dir, output_image_dir=None, is_dir=True
     ):
-        def add_image(images, width, height, image_id, image_path):
-            images.append(
-                {
-                    'width': width,
-                    'height': height,
-                    'id': image_id,
-                    'file_name': image_path,
-                }
-            )
-            return images
+        def add_image(images, width, height, image_path):
+            image = {
+                'width': width,
+                'height': height,
+                'id': len(images),
+                'file_name': image_path,
+            }
+            images.append(image)
+            return image
 
         self._check_format(Format.COCO)
         ensure_dir(output_dir)
@@ -580,21 +758,19 @@ class Converter(object):
             if is_dir
             else self.iter_from_json_file(input_data)
         )
-        for item_idx, item in enumerate(item_iterator):
-            image_path = item['input'][data_key]
-            image_id = len(images)
+        resources = ResourceTable()
+        # image url => COCO image, each distinct image is listed once
+        images_by_url = {}
+
+        def resolve_image(image_path, item):
             width = None
             height = None
+            local_path = image_path
             # download all images of the dataset, including the ones without annotations
             if not os.path.exists(image_path):
                 try:
-                    image_path = download(
-                        image_path,
-                        output_image_dir,
-                        project_dir=self.project_dir,
-                        return_relative_path=True,
-                        upload_dir=self.upload_dir,
-                        download_resources=self.download_resources,
+                    image_path, local_path = self._download_image(
+                        image_path, output_image_dir
                     )
                 except:
                     logger.info(
@@ -603,11 +779,14 @@ class Converter(object):
                         ),
                         exc_info=True,
                     )
-            # add image to final images list
+            if self.metadata_first:
+                size = self._image_size_from_results(item)
+                if size is not None:
+                    width, height = size
+                    return image_path, width, height
+            # read image size
             try:
-                with Image.open(os.path.join(output_dir, image_path)) as img:
-                    width, height = img.size
-                images = add_image(images, width, height, image_id, image_path)
+                width, height, _ = self._probe_image(local_path)
             except:
                 logger.info(
                     "Unable to open {image_path}, can't extract width and height for COCO export".format(
@@ -615,12 +794,29 @@ class Converter(object):
                     ),
                     exc_info=True,
                 )
+            return image_path, width, height
+
+        def resolve(item):
+            return resources.resolve(item['input'][data_key], resolve_image, item)
+
+        resolved = prefetch(item_iterator, resolve, self.prefetch_size)
+        for item_idx, (item, (image_path, width, height)) in enumerate(resolved):
+            image_url = item['input'][data_key]
+            image = images_by_url.get(image_url)
+            # add image to final images list
+            if image is None and width:
+                image = add_image(images, width, height, image_path)
+                images_by_url[image_url] = image
+            if image is not None:
+                width, height = image['width'], image['height']
 
             # skip tasks without annotations
             if not item['output']:
                 # image wasn't load and there are no labels
-                if not width:
-                    images = add_image(images, width, height, image_id, image_path)
+                if image is None:
+                    images_by_url[image_url] = add_image(
+                        images, width, height, image_path
+                    )
 
                 logger.warning('No annotations found for item #' + str(item_idx))
                 continue
@@ -636,7 +832,12 @@ class Converter(object):
 
             for label in labels:
                 category_name = None
-                for key in ['rectanglelabels', 'polygonlabels', 'labels']:
+                for key in [
+                    'rectanglelabels',
+                    'polygonlabels',
+                    'brushlabels',
+                    'labels',
+                ]:
                     if key in label and len(label[key]) > 0:
                         category_name = label[key][0]
                         break
@@ -653,7 +854,12 @@ class Converter(object):
                         continue
 
                     width, height = label['original_width'], label['original_height']
-                    images = add_image(images, width, height, image_id, image_path)
+                    if image is None:
+                        image = add_image(images, width, height, image_path)
+                        images_by_url[image_url] = image
+                    elif not image['width'] or not image['height']:
+                        # the image couldn't be opened, take its size from the first result
+                        image.update({'width': width, 'height': height})
 
                 if category_name not in category_name_to_id:
                     category_id = len(categories)
@@ -663,7 +869,35 @@ class Converter(object):
 
                 annotation_id = len(annotations)
 
-                if 'rectanglelabels' in label or 'labels' in label:
+                if 'rle' in label:
+                    # RLE is encoded at the size of the image the region was drawn on
+                    try:
+                        segmentation, area, bbox = brush.rle2coco(
+                            label['rle'],
+                            label.get('original_width', width),
+                            label.get('original_height', height),
+                            width,
+                            height,
+                        )
+                    except ValueError:
+                        logger.warning(
+                            f'Unable to convert brush region of {image_path} to COCO RLE, it will be skipped',
+                            exc_info=True,
+                        )
+                        continue
+                    annotations.append(
+                        {
+                            'id': annotation_id,
+                            'image_id': image['id'],
+                            'category_id': category_id,
+                            'segmentation': segmentation,
+                            'bbox': bbox,
+                            'ignore': 0,
+                            'iscrowd': 0,
+                            'area': area,
+                        }
+                    )
+                elif 'rectanglelabels' in label or 'labels' in label:
                     xywh = self.rotated_rectangle(label)
                     if xywh is None:
                         continue
@@ -677,7 +911,7 @@ class Converter(object):
                     annotations.append(
                         {
                             'id': annotation_id,
-                            'image_id': image_id,
+                            'image_id': image['id'],
                             'category_id': category_id,
                             'segmentation': [],
                             'bbox': [x, y, w, h],
@@ -695,7 +929,7 @@ class Converter(object):
                     annotations.append(
                         {
                             'id': annotation_id,
-                            'image_id': image_id,
+                            'image_id': image['id'],
                             'category_id': category_id,
                             'segmentation': [
                                 [coord for point in points_abs for coord in point]
@@ -784,20 +1018,14 @@ class Converter(object):
             if is_dir
             else self.iter_from_json_file(input_data)
         )
-        for item_idx, item in enumerate(item_iterator):
+
+        def resolve(item):
             # get image path and label file path
             image_path = item['input'][data_key]
             # download image
             if not os.path.exists(image_path):
                 try:
-                    image_path = download(
-                        image_path,
-                        output_image_dir,
-                        project_dir=self.project_dir,
-                        return_relative_path=True,
-                        upload_dir=self.upload_dir,
-                        download_resources=self.download_resources,
-                    )
+                    image_path = self._download(image_path, output_image_dir)
                 except:
                     logger.info(
                         'Unable to download {image_path}. The item {item} will be skipped'.format(
@@ -805,7 +1033,10 @@ class Converter(object):
                         ),
                         exc_info=True,
                     )
+            return image_path
 
+        resolved = prefetch(item_iterator, resolve, self.prefetch_size)
+        for item_idx, (item, image_path) in enumerate(resolved):
             # create dedicated subfolder for each labeler if split_labelers=True
             labeler_subfolder = str(item['completed_by']) if split_labelers else ''
             os.makedirs(
@@ -1011,22 +1242,16 @@ class Converter(object):
             if is_dir
             else self.iter_from_json_file(input_data)
         )
-        for item_idx, item in enumerate(item_iterator):
+        annotations_dir = os.path.join(output_dir, 'Annotations')
+
+        def resolve(item):
             image_path = item['input'][data_key]
-            annotations_dir = os.path.join(output_dir, 'Annotations')
-            if not os.path.exists(annotations_dir):
-                os.makedirs(annotations_dir)
             # Download image
             channels = 3
             if not os.path.exists(image_path):
                 try:
-                    image_path = download(
-                        image_path,
-                        output_image_dir,
-                        project_dir=self.project_dir,
-                        upload_dir=self.upload_dir,
-                        return_relative_path=True,
-                        download_resources=self.download_resources,
+                    image_path, local_path = self._download_image(
+                        image_path, output_image_dir
                     )
                 except:
                     logger.info(
@@ -1036,14 +1261,17 @@ class Converter(object):
                         exc_info=True,
                     )
                 else:
-                    full_image_path = os.path.join(
-                        output_image_dir, os.path.basename(image_path)
-                    )
                     # retrieve number of channels from downloaded image
                     try:
-                        _, _, channels = get_image_size_and_channels(full_image_path)
+                        _, _, channels = self._probe_image(local_path)
                     except:
                         logger.warning(f"Can't read channels from image")
+            return image_path, channels
+
+        resolved = prefetch(item_iterator, resolve, self.prefetch_size)
+        for item_idx, (item, (image_path, channels)) in enumerate(resolved):
+            if not os.path.exists(annotations_dir):
+                os.makedirs(annotations_dir)
 
             # skip tasks without annotations
             if not item['output']:
@@ -1129,28 +1357,35 @@ class Converter(object):
                 doc.writexml(fout, addindent='' * 4, newl='\n', encoding='utf-8')
 
     def _get_labels(self):
-        labels = set()
-        categories = list()
-        category_name_to_id = dict()
+        """Categories and {label: category id} for COCO and YOLO, computed once per Converter
 
-        for name, info in self._schema.items():
-            labels |= set(info['labels'])
-            attrs = info['labels_attrs']
-            for label in attrs:
-                if attrs[label].get('category'):
-                    categories.append(
-                        {'id': attrs[label].get('category'), 'name': label}
-                    )
-                    category_name_to_id[label] = attrs[label].get('category')
-        labels_to_add = set(labels) - set(list(category_name_to_id.keys()))
-        labels_to_add = sorted(list(labels_to_add))
-        idx = 0
-        while idx in list(category_name_to_id.values()):
-            idx += 1
-        for label in labels_to_add:
-            categories.append({'id': idx, 'name': label})
-            category_name_to_id[label] = idx
-            idx += 1
-            while idx in list(category_name_to_id.values()):
-                idx += 1
-        return categories, category_name_to_id
+        Labels with "category" attribute keep it, the others get the smallest free ids in sorted order.
+        Copies are returned, so formats can change them.
+        """
+        if self._labels is None:
+            labels = set()
+            categories = list()
+            category_name_to_id = dict()
+
+            for name, info in self._schema.items():
+                labels |= set(info['labels'])
+                attrs = info['labels_attrs']
+                for label in attrs:
+                    if attrs[label].get('category'):
+                        categories.append(
+                            {'id': attrs[label].get('category'), 'name': label}
+                        )
+                        category_name_to_id[label] = attrs[label].get('category')
+            labels_to_add = sorted(labels - set(category_name_to_id))
+            used_ids = set(category_name_to_id.values())
+            idx = 0
+            for label in labels_to_add:
+                while idx in used_ids:
+                    idx += 1
+                categories.append({'id': idx, 'name': label})
+                category_name_to_id[label] = idx
+                used_ids.add(idx)
+            self._labels = categories, category_name_to_id
+
+        categories, category_name_to_id = self._labels
+        return deepcopy(categories), dict(category_name_to_id)
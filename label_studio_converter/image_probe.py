@@ -0,0 +1,187 @@
+"""
+Fast image size probing: width, height and number of channels are read
+from the file header of JPEG, PNG, GIF, BMP, WebP and TIFF images without
+decoding them. Other formats and unusual headers are handled by PIL.
+Channels are counted the same way as len(PIL.Image.getbands()).
+"""
+
+import io
+import struct
+import logging
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HEADER_SIZE = 512
+
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# start of frame markers, all except DHT (C4), JPG (C8) and DAC (CC)
+_JPEG_SOF_MARKERS = {
+    0xC0,
+    0xC1,
+    0xC2,
+    0xC3,
+    0xC5,
+    0xC6,
+    0xC7,
+    0xC9,
+    0xCA,
+    0xCB,
+    0xCD,
+    0xCE,
+    0xCF,
+}
+# markers without length field
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+def _probe_png(f, header):
+    if header[12:16] != b'IHDR':
+        return None
+    width, height, _, color_type = struct.unpack('>IIBB', header[16:26])
+    channels = _PNG_CHANNELS.get(color_type)
+    return (width, height, channels) if channels else None
+
+
+def _probe_gif(f, header):
+    width, height = struct.unpack('<HH', header[6:10])
+    return width, height, 1
+
+
+def _probe_bmp(f, header):
+    dib_size = struct.unpack('<I', header[14:18])[0]
+    if dib_size == 12:
+        width, height, _, bits = struct.unpack('<hhHH', header[18:26])
+        compression = 0
+    else:
+        width, height, _, bits, compression = struct.unpack('<iiHHI', header[18:34])
+    if bits <= 8:
+        channels = 1
+    elif bits in (16, 24) and compression in (0, 3) or bits == 32 and compression == 0:
+        channels = 3
+    else:
+        # 32 bits with bit fields might have alpha, JPEG/PNG compression
+        return None
+    return abs(width), abs(height), channels
+
+
+def _probe_webp(f, header):
+    chunk = header[12:16]
+    if chunk == b'VP8X':
+        flags = header[20]
+        width = int.from_bytes(header[24:27], 'little') + 1
+        height = int.from_bytes(header[27:30], 'little') + 1
+        return width, height, 4 if flags & 0x10 else 3
+    if chunk == b'VP8 ':
+        if header[23:26] != b'\x9d\x01\x2a':
+            return None
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF, 3
+    if chunk == b'VP8L':
+        if header[20] != 0x2F:
+            return None
+        bits = int.from_bytes(header[21:25], 'little')
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+        alpha = (bits >> 28) & 1
+        return width, height, 4 if alpha else 3
+    return None
+
+
+def _probe_jpeg(f, header):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        while marker == b'\xff':  # fill bytes
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9:  # end of image
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(6)
+            if len(data) < 6:
+                return None
+            _, height, width, components = struct.unpack('>BHHB', data)
+            if components not in (1, 3, 4):
+                return None
+            return width, height, components
+        f.seek(length - 2, io.SEEK_CUR)
+
+
+def _probe_tiff(f, header):
+    endian = '<' if header[:2] == b'II' else '>'
+    offset = struct.unpack(endian + 'I', header[4:8])[0]
+    f.seek(offset)
+    count_bytes = f.read(2)
+    if len(count_bytes) < 2:
+        return None
+    count = struct.unpack(endian + 'H', count_bytes)[0]
+    entries = f.read(12 * count)
+    if len(entries) < 12 * count:
+        return None
+
+    tags = {}
+    for i in range(count):
+        tag, type_, _, value = struct.unpack(
+            endian + 'HHI4s', entries[12 * i : 12 * (i + 1)]
+        )
+        if tag not in (256, 257, 277):
+            continue
+        if type_ == 3:  # SHORT
+            tags[tag] = struct.unpack(endian + 'H', value[:2])[0]
+        elif type_ == 4:  # LONG
+            tags[tag] = struct.unpack(endian + 'I', value)[0]
+    if 256 not in tags or 257 not in tags:
+        return None
+    return tags[256], tags[257], tags.get(277, 1)
+
+
+def _probe_header(f, header):
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return _probe_png(f, header)
+    if header.startswith(b'\xff\xd8'):
+        return _probe_jpeg(f, header)
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return _probe_gif(f, header)
+    if header.startswith(b'BM'):
+        return _probe_bmp(f, header)
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return _probe_webp(f, header)
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return _probe_tiff(f, header)
+    return None
+
+
+def probe_image(image_path):
+    """Get image width, height and number of channels reading only the file header
+
+    :param image_path: path to image file
+    :return: tuple (width, height, channels)
+    """
+    with io.open(image_path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        try:
+            result = _probe_header(f, header)
+        except (struct.error, IndexError, OSError):
+            logger.debug(f"Can't parse header of {image_path}", exc_info=True)
+            result = None
+    if result is not None:
+        return result
+
+    with Image.open(image_path) as image:
+        width, height = image.size
+        return width, height, len(image.getbands())
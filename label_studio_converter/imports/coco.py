@@ -1,11 +1,20 @@
 import os
 import json  # better to use "imports ujson as json" for the best performance
 import uuid
+import shutil
+import sqlite3
 import logging
-from PIL import Image
+import tempfile
 
+import ijson
+import numpy as np
+
+from collections import defaultdict
+
+from label_studio_converter import brush
 from label_studio_converter.utils import ExpandFullPath
 from label_studio_converter.imports.label_config import generate_label_config
+from label_studio_converter.imports.task_writer import TaskWriter, add_writer_args
 
 logger = logging.getLogger('root')
 
@@ -71,6 +80,73 @@ def create_segmentation(
     return item
 
 
+def decode_rle_counts(counts):
+    """Decode compressed COCO RLE counts string (pycocotools format) to run lengths
+
+    Each count is a LEB128-like sequence of 5 bit chunks with sign extension,
+    counts after the second one are stored as a delta to the count two positions back.
+    """
+    chars = np.frombuffer(counts.encode('ascii'), dtype=np.uint8).astype(np.int64) - 48
+    if len(chars) == 0:
+        return np.zeros(0, dtype=np.int64)
+    last = (chars & 0x20) == 0  # last chunk of a count
+    ends = np.flatnonzero(last)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shift = 5 * (np.arange(len(chars)) - np.repeat(starts, ends - starts + 1))
+    values = np.add.reduceat((chars & 0x1F) << shift, starts)
+    negative = (chars[ends] & 0x10) != 0
+    values[negative] -= np.int64(1) << (shift[ends[negative]] + 5)
+
+    # undo deltas: odd counts from the 3rd, even counts from the 4th
+    values[1::2] = np.cumsum(values[1::2])
+    values[2::2] = np.cumsum(values[2::2])
+    return values
+
+
+def coco_rle2runs(segmentation):
+    """Convert COCO RLE to row-major runs of a Label Studio brush (RGBA values 0 or 255)
+
+    :param segmentation: COCO RLE dict {"size": [height, width], "counts": list or compressed string}
+    :return: tuple (run lengths, run values)
+    """
+    height, width = segmentation['size']
+    counts = segmentation['counts']
+    if isinstance(counts, str):
+        counts = decode_rle_counts(counts)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    # COCO runs go column by column starting with background,
+    # transpose them through a bit mask to get runs row by row
+    mask = np.repeat(np.arange(len(counts)) % 2 == 1, counts)
+    mask = mask.reshape(width, height).T.ravel()
+    changes = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    bounds = np.concatenate([[0], changes, [len(mask)]])
+    lengths = np.diff(bounds)
+    values = mask[bounds[:-1]].astype(np.int64) * 255
+    # every pixel takes 4 values (R, G, B, alpha)
+    return lengths * 4, values
+
+
+def create_rle(annotation, categories, from_name, image_height, image_width, to_name):
+    label = categories[int(annotation['category_id'])]
+    lengths, values = coco_rle2runs(annotation['segmentation'])
+    item = {
+        "id": uuid.uuid4().hex[0:10],
+        "type": "brushlabels",
+        "value": {
+            "rle": brush.runs2rle(lengths, values),
+            "format": "rle",
+            "brushlabels": [label],
+        },
+        "to_name": to_name,
+        "from_name": from_name,
+        "image_rotation": 0,
+        "original_width": image_width,
+        "original_height": image_height,
+    }
+    return item
+
+
 def create_keypoints(
     annotation, categories, from_name, to_name, image_height, image_width, point_width
 ):
@@ -105,6 +181,83 @@ def create_keypoints(
     return items
 
 
+class AnnotationGroups(object):
+    """Label Studio results grouped by image index
+
+    Results are kept in memory until there are more than `max_in_memory` of them,
+    then they are spilled to a temporary SQLite database, so the memory stays bounded
+    for datasets with millions of annotations.
+    """
+
+    def __init__(self, max_in_memory=1000000):
+        self.max_in_memory = max_in_memory
+        self._groups = defaultdict(list)
+        self._size = 0
+        self._tmp_dir = None
+        self._db = None
+
+    def add(self, key, results):
+        self._groups[key] += results
+        self._size += len(results)
+        if self._size > self.max_in_memory:
+            self._spill()
+
+    def _spill(self):
+        if self._db is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='coco-import-')
+            self._db = sqlite3.connect(os.path.join(self._tmp_dir, 'results.sqlite3'))
+            self._db.execute('CREATE TABLE results (key INTEGER, result TEXT)')
+            logger.info(f'Spill annotations to {self._tmp_dir}')
+        with self._db:
+            self._db.executemany(
+                'INSERT INTO results (key, result) VALUES (?, ?)',
+                (
+                    (key, json.dumps(result))
+                    for key, results in self._groups.items()
+                    for result in results
+                ),
+            )
+        self._groups.clear()
+        self._size = 0
+
+    def iter_groups(self, count):
+        """Yield results for keys 0..count-1 in the order they were added"""
+        rows = iter(())
+        if self._db is not None:
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_key ON results (key)')
+            rows = self._db.execute(
+                'SELECT key, result FROM results ORDER BY key, rowid'
+            )
+        row = next(rows, None)
+        for key in range(count):
+            results = []
+            # spilled results always precede the ones still in memory
+            while row is not None and row[0] == key:
+                results.append(json.loads(row[1]))
+                row = next(rows, None)
+            results += self._groups.pop(key, [])
+            yield results
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_coco(input_file, prefix):
+    """Stream items of a top level COCO list ("images", "annotations", etc) without loading the whole file"""
+    with open(input_file, 'rb') as f:
+        for item in ijson.items(f, prefix + '.item', use_float=True):
+            yield item
+
+
 def convert_coco_to_ls(
     input_file,
     out_file,
@@ -114,9 +267,16 @@ def convert_coco_to_ls(
     image_root_url='/data/local-files/?d=',
     use_super_categories=False,
     point_width=1.0,
+    max_in_memory=1000000,
+    out_format='json',
+    shard_size=None,
+    shard_bytes=None,
 ):
     """Convert COCO labeling to Label Studio JSON
 
+    COCO file is streamed in several passes (categories, images, annotations),
+    tasks are written one by one with TaskWriter, so multi-GB files don't need to fit into memory.
+
     :param input_file: file with COCO json
     :param out_file: output file with Label Studio JSON tasks
     :param to_name: object name from Label Studio labeling config
@@ -125,18 +285,21 @@ def convert_coco_to_ls(
     :param image_root_url: root URL path where images will be hosted, e.g.: http://example.com/images
     :param use_super_categories: use super categories from categories if they are presented
     :param point_width: key point width
+    :param max_in_memory: max number of results kept in memory, the rest is spilled to a temporary database
+    :param out_format: "json" or "jsonl", see task_writer.TaskWriter
+    :param shard_size: split output to files with this number of tasks
+    :param shard_bytes: split output to files of this size in bytes
     """
 
-    tasks = {}  # image_id => task
     logger.info('Reading COCO notes and categories from %s', input_file)
 
-    with open(input_file, encoding='utf8') as f:
-        coco = json.load(f)
-
     # build categories => labels dict
     new_categories = {}
     # list to dict conversion: [...] => {category_id: category_item}
-    categories = {int(category['id']): category for category in coco['categories']}
+    categories = {
+        int(category['id']): category
+        for category in iter_coco(input_file, 'categories')
+    }
     ids = sorted(categories.keys())  # sort labels by their origin ids
 
     for i in ids:
@@ -148,12 +311,14 @@ def convert_coco_to_ls(
     # mapping: id => category name
     categories = new_categories
 
-    # mapping: image id => image
-    images = {item['id']: item for item in coco['images']}
-
-    logger.info(
-        f'Found {len(categories)} categories, {len(images)} images and {len(coco["annotations"])} annotations'
-    )
+    # mapping: image id => (file name, width, height), only fields needed for tasks are kept
+    images = {
+        image['id']: (image['file_name'], image['width'], image['height'])
+        for image in iter_coco(input_file, 'images')
+    }
+    # tasks are written in the order of image ids
+    image_ids = sorted(images.keys())
+    image_index = {image_id: i for i, image_id in enumerate(image_ids)}
 
     # flags for labeling config composing
     segmentation = bbox = keypoints = rle = False
@@ -163,103 +328,116 @@ def convert_coco_to_ls(
         from_name + '_keypoints',
     )
     segmentation_from_name = from_name + 'polygons'
+    brush_from_name = from_name + '_brush'
     tags = {}
 
-    # create tasks
-    for image in coco['images']:
-        image_id, image_file_name = image['id'], image['file_name']
-        tasks[image_id] = new_task(out_type, image_root_url, image_file_name)
-
-    for i, annotation in enumerate(coco['annotations']):
-        segmentation |= 'segmentation' in annotation
-        bbox |= 'bbox' in annotation
-        keypoints |= 'keypoints' in annotation
-        rle |= (
-            annotation.get('iscrowd') == 1
-        )  # 0 - polygons are in segmentation, otherwise rle
-
-        if rle and not rle_once:  # not supported
-            logger.error('RLE in segmentation is not yet supported in COCO')
-            rle_once = True
-        if keypoints and not keypoints_once:
-            logger.warning('Keypoints are partially supported without skeletons')
-            tags.update({keypoints_from_name: 'KeyPointLabels'})
-            keypoints_once = True
-        if segmentation and not segmentation_once:  # not supported
-            logger.warning('Segmentation in COCO is experimental')
-            tags.update({segmentation_from_name: 'PolygonLabels'})
-            segmentation_once = True
-        if bbox and not bbox_once:
-            tags.update({rectangles_from_name: 'RectangleLabels'})
-            bbox_once = True
-
-        # read image sizes
-        image_id = annotation['image_id']
-        image = images[image_id]
-        image_file_name, image_width, image_height = (
-            image['file_name'],
-            image['width'],
-            image['height'],
+    with AnnotationGroups(max_in_memory) as groups:
+        annotations_count = 0
+        for annotation in iter_coco(input_file, 'annotations'):
+            annotations_count += 1
+            # polygons are in a list, RLE (usually iscrowd=1) is in a dict
+            is_rle = isinstance(annotation.get('segmentation'), dict)
+            segmentation |= 'segmentation' in annotation and not is_rle
+            bbox |= 'bbox' in annotation
+            keypoints |= 'keypoints' in annotation
+            rle |= is_rle
+
+            if rle and not rle_once:
+                logger.warning('RLE in segmentation is converted to brush labels')
+                tags.update({brush_from_name: 'BrushLabels'})
+                rle_once = True
+            if keypoints and not keypoints_once:
+                logger.warning('Keypoints are partially supported without skeletons')
+                tags.update({keypoints_from_name: 'KeyPointLabels'})
+                keypoints_once = True
+            if segmentation and not segmentation_once:  # not supported
+                logger.warning('Segmentation in COCO is experimental')
+                tags.update({segmentation_from_name: 'PolygonLabels'})
+                segmentation_once = True
+            if bbox and not bbox_once:
+                tags.update({rectangles_from_name: 'RectangleLabels'})
+                bbox_once = True
+
+            # read image sizes
+            image_id = annotation['image_id']
+            image_file_name, image_width, image_height = images[image_id]
+
+            results = []
+            if 'bbox' in annotation:
+                item = create_bbox(
+                    annotation,
+                    categories,
+                    rectangles_from_name,
+                    image_height,
+                    image_width,
+                    to_name,
+                )
+                results.append(item)
+
+            if is_rle:
+                item = create_rle(
+                    annotation,
+                    categories,
+                    brush_from_name,
+                    image_height,
+                    image_width,
+                    to_name,
+                )
+                results.append(item)
+            elif annotation.get('segmentation', []):
+                item = create_segmentation(
+                    annotation,
+                    categories,
+                    segmentation_from_name,
+                    image_height,
+                    image_width,
+                    to_name,
+                )
+                results.append(item)
+
+            if 'keypoints' in annotation:
+                items = create_keypoints(
+                    annotation,
+                    categories,
+                    keypoints_from_name,
+                    to_name,
+                    image_height,
+                    image_width,
+                    point_width,
+                )
+                results += items
+
+            groups.add(image_index[image_id], results)
+
+        logger.info(
+            f'Found {len(categories)} categories, {len(images)} images and {annotations_count} annotations'
         )
 
-        task = tasks[image_id]
+        writer = TaskWriter(out_file, out_format, shard_size, shard_bytes)
 
-        if 'bbox' in annotation:
-            item = create_bbox(
-                annotation,
-                categories,
-                rectangles_from_name,
-                image_height,
-                image_width,
-                to_name,
-            )
-            task[out_type][0]['result'].append(item)
-
-        if annotation.get('segmentation', []):
-            item = create_segmentation(
-                annotation,
-                categories,
-                segmentation_from_name,
-                image_height,
-                image_width,
-                to_name,
-            )
-            task[out_type][0]['result'].append(item)
-
-        if 'keypoints' in annotation:
-            items = create_keypoints(
-                annotation,
-                categories,
-                keypoints_from_name,
-                to_name,
-                image_height,
-                image_width,
-                point_width,
+        # generate and save labeling config
+        label_config_file = writer.base + '.label_config.xml'
+        generate_label_config(categories, tags, to_name, from_name, label_config_file)
+
+        with writer:
+            for i, results in enumerate(groups.iter_groups(len(image_ids))):
+                task = new_task(out_type, image_root_url, images[image_ids[i]][0])
+                task[out_type][0]['result'] = results
+                writer.write(task)
+
+        if writer.count > 0:
+            logger.info('Saved Label Studio JSON to %s', writer.describe())
+
+            print(
+                '\n'
+                f'  1. Create a new project in Label Studio\n'
+                f'  2. Use Labeling Config from "{label_config_file}"\n'
+                f'  3. Setup serving for images [e.g. you can use Local Storage (or others):\n'
+                f'     https://labelstud.io/guide/storage.html#Local-storage]\n'
+                f'  4. Import {writer.describe()} to the project\n'
             )
-            task[out_type][0]['result'] += items
-
-        tasks[image_id] = task
-
-    # generate and save labeling config
-    label_config_file = out_file.replace('.json', '') + '.label_config.xml'
-    generate_label_config(categories, tags, to_name, from_name, label_config_file)
-
-    if len(tasks) > 0:
-        tasks = [tasks[key] for key in sorted(tasks.keys())]
-        logger.info('Saving Label Studio JSON to %s', out_file)
-        with open(out_file, 'w') as out:
-            json.dump(tasks, out)
-
-        print(
-            '\n'
-            f'  1. Create a new project in Label Studio\n'
-            f'  2. Use Labeling Config from "{label_config_file}"\n'
-            f'  3. Setup serving for images [e.g. you can use Local Storage (or others):\n'
-            f'     https://labelstud.io/guide/storage.html#Local-storage]\n'
-            f'  4. Import "{out_file}" to the project\n'
-        )
-    else:
-        logger.error('No labels converted')
+        else:
+            logger.error('No labels converted')
 
 
 def add_parser(subparsers):
@@ -312,3 +490,11 @@ def add_parser(subparsers):
         default=1.0,
         type=float,
     )
+    coco.add_argument(
+        '--max-in-memory',
+        dest='max_in_memory',
+        help='max number of annotations kept in memory, the rest is spilled to a temporary database',
+        default=1000000,
+        type=int,
+    )
+    add_writer_args(coco)
@@ -0,0 +1,318 @@
+"""Masks (binary or indexed images) to Label Studio brush labels convert"""
+
+import os
+import json
+import uuid
+import logging
+import functools
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from urllib.request import pathname2url
+from PIL import Image
+
+from label_studio_converter import brush
+from label_studio_converter.utils import ExpandFullPath
+from label_studio_converter.imports.label_config import generate_label_config
+from label_studio_converter.imports.task_writer import TaskWriter, add_writer_args
+
+logger = logging.getLogger('root')
+default_image_root_url = '/data/local-files/?d='
+
+
+def find_masks(input_dir, mask_ext='.png'):
+    """Walk directory tree and return sorted relative paths of mask files"""
+    mask_ext = tuple(x.strip() for x in mask_ext.split(','))
+    paths = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for f in sorted(files):
+            if f.endswith(mask_ext):
+                paths.append(os.path.relpath(os.path.join(root, f), input_dir))
+    return paths
+
+
+def mask2results(path, label_map, from_name, to_name, binary=False):
+    """Convert mask image to brush results, one per label found in the mask
+
+    :param path: path to mask image
+    :param label_map: {label name: mask value}, for binary masks {label name: 255}
+    :param from_name: brush tag name (<BrushLabels>)
+    :param to_name: image tag name (<Image>)
+    :param binary: threshold mask with values > 128 instead of exact values
+    :return: list of results
+    """
+    with Image.open(path) as image:
+        if binary:
+            image = image.convert('L')
+        mask = np.array(image)
+    if binary:
+        mask = np.where(mask > 128, 255, 0)
+    if mask.ndim != 2:
+        raise ValueError(f'{path} must be a grayscale or palette image')
+
+    labels_by_value = {}
+    for label, value in label_map.items():
+        labels_by_value.setdefault(value, []).append(label)
+
+    height, width = mask.shape
+    results = []
+    # compare the mask only with values it has
+    for value in np.unique(mask).tolist():
+        labels = labels_by_value.get(value)
+        if not labels:
+            continue
+        rle = brush.mask2rle((mask == value).astype(np.uint8) * 255)
+        results += [
+            {
+                "id": str(uuid.uuid4())[0:8],
+                "type": "brushlabels",
+                "value": {
+                    "rle": rle,
+                    "format": "rle",
+                    "brushlabels": [label],
+                },
+                "origin": "manual",
+                "to_name": to_name,
+                "from_name": from_name,
+                "image_rotation": 0,
+                "original_width": width,
+                "original_height": height,
+            }
+            for label in labels
+        ]
+    return results
+
+
+def _convert_mask(
+    mask_path,
+    input_dir,
+    label_map,
+    from_name,
+    to_name,
+    binary,
+    out_type,
+    image_root_url,
+    image_ext,
+    model_version,
+    score,
+):
+    """Convert one mask file to Label Studio task, None if the mask can't be converted"""
+    try:
+        results = mask2results(
+            os.path.join(input_dir, mask_path), label_map, from_name, to_name, binary
+        )
+    except Exception:
+        logger.warning(
+            'Unable to convert mask %s, it will be skipped', mask_path, exc_info=True
+        )
+        return None
+    image_path = mask_path
+    if image_ext:
+        image_path = os.path.splitext(mask_path)[0] + image_ext
+    task = {"data": {"image": image_root_url + pathname2url(image_path)}}
+
+    # prediction
+    if out_type == 'predictions':
+        task[out_type] = [
+            {"result": results, "model_version": model_version, "score": score}
+        ]
+    # annotation
+    else:
+        task[out_type] = [{"result": results, "ground_truth": False}]
+    return task
+
+
+def convert_masks_to_ls(
+    input_dir,
+    out_file,
+    label_map=None,
+    label='Object',
+    to_name='image',
+    from_name='tag',
+    out_type='annotations',
+    image_root_url=default_image_root_url,
+    mask_ext='.png',
+    image_ext=None,
+    model_version=None,
+    score=None,
+    workers=1,
+    chunk_size=16,
+    out_format='json',
+    shard_size=None,
+    shard_bytes=None,
+):
+    """Convert directory tree with masks to Label Studio JSON with brush labels
+
+    :param input_dir: directory with mask images, subdirectories are included
+    :param out_file: output file with Label Studio JSON tasks
+    :param label_map: indexed masks - {label name: mask value} or path to JSON file with it
+                      (e.g. labels.json from BRUSH_TO_INDEXED_PNG export), None for binary masks
+    :param label: label name for binary masks, pixels > 128 are the object
+    :param to_name: object name from Label Studio labeling config
+    :param from_name: control tag name from Label Studio labeling config
+    :param out_type: annotation type - "annotations" or "predictions"
+    :param image_root_url: root URL path where images will be hosted, e.g.: http://example.com/images
+    :param mask_ext: mask extension/s - comma separated list, e.g. .png,.bmp
+    :param image_ext: extension of images if it's different from masks, e.g. .jpg
+    :param model_version: model version for predictions
+    :param score: prediction score
+    :param workers: number of processes to read and encode masks
+    :param chunk_size: number of masks sent to a process at once
+    :param out_format: "json" or "jsonl", see task_writer.TaskWriter
+    :param shard_size: split output to files with this number of tasks
+    :param shard_bytes: split output to files of this size in bytes
+    """
+    binary = label_map is None
+    if binary:
+        label_map = {label: 255}
+    elif isinstance(label_map, str):
+        with open(label_map) as f:
+            label_map = json.load(f)
+
+    writer = TaskWriter(out_file, out_format, shard_size, shard_bytes)
+
+    # generate and save labeling config
+    label_config_file = writer.base + '.label_config.xml'
+    categories = {i: name for i, name in enumerate(label_map)}
+    generate_label_config(
+        categories, {from_name: 'BrushLabels'}, to_name, from_name, label_config_file
+    )
+
+    masks = find_masks(input_dir, mask_ext)
+    logger.info(f'Found {len(masks)} masks in {input_dir}')
+    convert_mask = functools.partial(
+        _convert_mask,
+        input_dir=input_dir,
+        label_map=label_map,
+        from_name=from_name,
+        to_name=to_name,
+        binary=binary,
+        out_type=out_type,
+        image_root_url=image_root_url,
+        image_ext=image_ext,
+        model_version=model_version,
+        score=score,
+    )
+
+    with writer:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # map() keeps the order of masks
+                tasks = executor.map(convert_mask, masks, chunksize=chunk_size)
+                for task in tasks:
+                    if task is not None:
+                        writer.write(task)
+        else:
+            for mask_path in masks:
+                task = convert_mask(mask_path)
+                if task is not None:
+                    writer.write(task)
+
+    if writer.count < len(masks):
+        logger.warning(f'{len(masks) - writer.count} masks were skipped')
+
+    if writer.count > 0:
+        logger.info('Saved Label Studio JSON to %s', writer.describe())
+        print(
+            '\n'
+            f'  1. Create a new project in Label Studio\n'
+            f'  2. Use Labeling Config from "{label_config_file}"\n'
+            f'  3. Setup serving for images [e.g. you can use Local Storage (or others):\n'
+            f'     https://labelstud.io/guide/storage.html#Local-storage]\n'
+            f'  4. Import {writer.describe()} to the project\n'
+        )
+    else:
+        logger.error('No masks converted')
+
+
+def add_parser(subparsers):
+    masks = subparsers.add_parser('masks')
+
+    masks.add_argument(
+        '-i',
+        '--input',
+        dest='input',
+        required=True,
+        help='directory with mask images, subdirectories are included',
+        action=ExpandFullPath,
+    )
+    masks.add_argument(
+        '-o',
+        '--output',
+        dest='output',
+        help='output file with Label Studio JSON tasks',
+        default='output.json',
+        action=ExpandFullPath,
+    )
+    masks.add_argument(
+        '--label-map',
+        dest='label_map',
+        help='JSON file with {label name: mask value} for indexed masks, binary masks are expected without it',
+        default=None,
+        action=ExpandFullPath,
+    )
+    masks.add_argument(
+        '--label',
+        dest='label',
+        help='label name for binary masks',
+        default='Object',
+    )
+    masks.add_argument(
+        '--to-name',
+        dest='to_name',
+        help='object name from Label Studio labeling config',
+        default='image',
+    )
+    masks.add_argument(
+        '--from-name',
+        dest='from_name',
+        help='control tag name from Label Studio labeling config',
+        default='tag',
+    )
+    masks.add_argument(
+        '--out-type',
+        dest='out_type',
+        help='annotation type - "annotations" or "predictions"',
+        default='annotations',
+    )
+    masks.add_argument(
+        '--image-root-url',
+        dest='image_root_url',
+        help='root URL path where images will be hosted, e.g.: http://example.com/images',
+        default=default_image_root_url,
+    )
+    masks.add_argument(
+        '--mask-ext',
+        dest='mask_ext',
+        help='mask extensions to search, comma separated: .png,.bmp',
+        default='.png',
+    )
+    masks.add_argument(
+        '--image-ext',
+        dest='image_ext',
+        help='image extension if it differs from masks, e.g. .jpg',
+        default=None,
+    )
+    masks.add_argument(
+        '--model-version',
+        dest='model_version',
+        help='model version for predictions',
+        default=None,
+    )
+    masks.add_argument(
+        '--score',
+        dest='score',
+        help='prediction score',
+        default=None,
+        type=float,
+    )
+    masks.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        help='number of processes to read and encode masks',
+        default=1,
+    )
+    add_writer_args(masks)
@@ -3,12 +3,13 @@ https://www.trace.ethz.ch/publications/2017/pathtrack/index.html
 """
 import os
 import sys
-import json
 import uuid
 import logging
 
 from types import SimpleNamespace
 
+from label_studio_converter.imports.task_writer import TaskWriter
+
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
@@ -199,6 +200,9 @@ def convert_dataset(
     source_value='video',
     target_fps=None,
     hop_keyframes=0,
+    out_format='json',
+    shard_size=None,
+    shard_bytes=None,
 ):
     """Convert PathTrack dataset to Label Studio video labeling format
 
@@ -209,42 +213,44 @@ def convert_dataset(
     :param source_value: source name for Video tag, e.g. $video
     :param target_fps: keep video with this fps only
     :param hop_keyframes: how many keyframes to skip
+    :param out_format: "json" or "jsonl", see task_writer.TaskWriter
+    :param shard_size: split output to files with this number of tasks
+    :param shard_bytes: split output to files of this size in bytes
     """
     logger.info('Convert dataset start: %s', root_dir)
-    tasks = []
+    fps_name = int(target_fps)
+    path = os.path.join(root_dir, f'import-{fps_name}.json')
+    writer = TaskWriter(path, out_format, shard_size, shard_bytes, write_empty=True)
 
     if not root_url.endswith('/'):
         root_url += '/'
 
-    for d in os.listdir(root_dir):
-        shot_dir = os.path.join(root_dir, d)
-        if not os.path.isdir(shot_dir):
-            continue
-
-        input_url = root_url + d + '/video.mp4'
-        label_file = os.path.join(shot_dir, 'gt/gt.txt')
-        info_file = os.path.join(shot_dir, 'info.xml')
-
-        task = convert_shot(
-            input_url,
-            label_file,
-            info_file,
-            from_name,
-            to_name,
-            source_value,
-            target_fps,
-            hop_keyframes,
-        )
-        if task is None:
-            continue
-
-        tasks.append(task)
-
-    fps_name = int(target_fps)
-    path = os.path.join(root_dir, f'import-{fps_name}.json')
-    logger.info('Saving Label Studio JSON: %s', path)
-    with open(path, 'w') as f:
-        json.dump(tasks, f)
+    with writer:
+        for d in os.listdir(root_dir):
+            shot_dir = os.path.join(root_dir, d)
+            if not os.path.isdir(shot_dir):
+                continue
+
+            input_url = root_url + d + '/video.mp4'
+            label_file = os.path.join(shot_dir, 'gt/gt.txt')
+            info_file = os.path.join(shot_dir, 'info.xml')
+
+            task = convert_shot(
+                input_url,
+                label_file,
+                info_file,
+                from_name,
+                to_name,
+                source_value,
+                target_fps,
+                hop_keyframes,
+            )
+            if task is None:
+                continue
+
+            writer.write(task)
+
+    logger.info('Saved Label Studio JSON: %s', writer.describe())
 
     path = os.path.join(root_dir, f'config-{fps_name}.xml')
     logger.info('Saving Labeling Config: %s', path)
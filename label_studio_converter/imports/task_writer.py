@@ -0,0 +1,166 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger('root')
+
+OUT_FORMATS = ('json', 'jsonl')
+
+
+class TaskWriter(object):
+    """Write Label Studio tasks one by one to a JSON file or to shards
+
+    By default all tasks go to `out_file` and the file is the same as
+    json.dump(tasks) would produce. With `shard_size` or `shard_bytes` tasks are
+    split to <name>-00000.json, <name>-00001.json, etc next to `out_file`, and
+    <name>.manifest.json lists the shards, so they can be imported in parallel.
+    The extension of the output files follows out_format, e.g. tasks.json becomes
+    tasks.jsonl for "jsonl". Files are created on the first task, nothing is written
+    if there are no tasks unless `write_empty` is set.
+    """
+
+    def __init__(
+        self,
+        out_file,
+        out_format='json',
+        shard_size=None,
+        shard_bytes=None,
+        write_empty=False,
+    ):
+        """
+        :param out_file: output file with Label Studio tasks, its name is the base for shard names
+        :param out_format: "json" - list of tasks, "jsonl" - one task per line
+        :param shard_size: max number of tasks per shard
+        :param shard_bytes: max size of shard in bytes, a shard has at least one task
+        :param write_empty: write an empty output file (or shard) if there are no tasks
+        """
+        if out_format not in OUT_FORMATS:
+            raise ValueError(
+                f'Unknown output format {out_format}, use one of {OUT_FORMATS}'
+            )
+        self.out_format = out_format
+        self.shard_size = shard_size
+        self.shard_bytes = shard_bytes
+        self.sharded = bool(shard_size or shard_bytes)
+        self.write_empty = write_empty
+        self.count = 0
+        self.shards = []  # [{'file': name, 'tasks': count, 'bytes': size}]
+
+        base = out_file
+        for ext in ('.' + f for f in OUT_FORMATS):
+            if base.endswith(ext):
+                base = base[: -len(ext)]
+                # keep the extension consistent with the content
+                out_file = f'{base}.{out_format}'
+                break
+        self.out_file = out_file
+        # output file name without the extension, e.g. for shard and manifest names
+        self.base = base
+        self.manifest_file = base + '.manifest.json'
+        self._file = None
+        self._shard = None
+
+    @property
+    def files(self):
+        """Paths of the written files"""
+        root = os.path.dirname(self.out_file)
+        return [os.path.join(root, shard['file']) for shard in self.shards]
+
+    def _open(self):
+        if self.sharded:
+            path = f'{self.base}-{len(self.shards):05d}.{self.out_format}'
+        else:
+            path = self.out_file
+        logger.debug('Write tasks to %s', path)
+        self._file = open(path, 'w')
+        self._shard = {'file': os.path.basename(path), 'tasks': 0, 'bytes': 0}
+        self.shards.append(self._shard)
+        if self.out_format == 'json':
+            self._write('[')
+
+    def _write(self, text):
+        self._file.write(text)
+        # json.dumps escapes non-ascii characters, so the length is in bytes
+        self._shard['bytes'] += len(text)
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        if self.out_format == 'json':
+            self._write(']')
+        self._file.close()
+        self._file = None
+
+    def _is_full(self, size):
+        if not self.sharded or self._shard['tasks'] == 0:
+            return False
+        if self.shard_size and self._shard['tasks'] >= self.shard_size:
+            return True
+        return bool(self.shard_bytes) and self._shard['bytes'] + size > self.shard_bytes
+
+    def write(self, task):
+        text = json.dumps(task)
+        if self._file is not None and self._is_full(len(text) + 2):
+            self._close_file()
+        if self._file is None:
+            self._open()
+
+        if self.out_format == 'jsonl':
+            self._write(text + '\n')
+        else:
+            # the same separator as json.dump uses for lists
+            self._write((', ' if self._shard['tasks'] else '') + text)
+        self._shard['tasks'] += 1
+        self.count += 1
+
+    def close(self):
+        if self.write_empty and not self.shards:
+            self._open()
+        self._close_file()
+        if self.sharded and self.shards:
+            with open(self.manifest_file, 'w') as f:
+                json.dump(
+                    {
+                        'format': self.out_format,
+                        'tasks': self.count,
+                        'shards': self.shards,
+                    },
+                    f,
+                    indent=2,
+                )
+
+    def describe(self):
+        """Human readable description of the output for import instructions"""
+        if self.sharded:
+            return f'{len(self.shards)} files listed in "{self.manifest_file}"'
+        return f'"{self.out_file}"'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def add_writer_args(parser):
+    parser.add_argument(
+        '--out-format',
+        dest='out_format',
+        choices=OUT_FORMATS,
+        help='output format: json - list of tasks, jsonl - one task per line',
+        default='json',
+    )
+    parser.add_argument(
+        '--shard-size',
+        dest='shard_size',
+        type=int,
+        help='split output to files with this number of tasks and write a manifest with the list of files',
+        default=None,
+    )
+    parser.add_argument(
+        '--shard-bytes',
+        dest='shard_bytes',
+        type=int,
+        help='split output to files of this size in bytes and write a manifest with the list of files',
+        default=None,
+    )
@@ -1,22 +1,123 @@
 import os
-import json  # better to use "imports ujson as json" for the best performance
-
 import uuid
 import logging
+import functools
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
 
-from PIL import Image
 from typing import Optional, Tuple
 from urllib.request import (
     pathname2url,
 )  # for converting "+","*", etc. in file paths to appropriate urls
 
-from label_studio_converter.utils import ExpandFullPath
+from label_studio_converter.utils import ExpandFullPath, get_image_size
+from label_studio_converter.cache import ImageMetaCache
 from label_studio_converter.imports.label_config import generate_label_config
+from label_studio_converter.imports.task_writer import TaskWriter, add_writer_args
 
 logger = logging.getLogger('root')
 default_image_root_url = '/data/local-files/?d=images'
 
 
+# image metadata cache of a worker process
+_worker_meta_cache = None
+
+
+def _init_worker(image_meta_cache):
+    global _worker_meta_cache
+    if image_meta_cache is not None:
+        _worker_meta_cache = ImageMetaCache(image_meta_cache)
+
+
+def _read_labels(label_file):
+    """Read YOLO label file as rows of floats: label id, x, y, width, height and optional score"""
+    with open(label_file) as f:
+        rows = [line.split() for line in f]
+    rows = [row for row in rows if row]
+    if not rows:
+        return []
+    if all(len(row) == len(rows[0]) for row in rows):
+        # parse all values at once when rows have the same number of columns
+        return np.array(rows, dtype=np.float64)[:, :6].tolist()
+    return [[float(value) for value in row[:6]] for row in rows]
+
+
+def _convert_image(
+    image_file,
+    images_dir,
+    labels_dir,
+    categories,
+    to_name,
+    from_name,
+    out_type,
+    image_root_url,
+    image_dims=None,
+    image_meta_cache=None,
+):
+    """Convert one image with its YOLO label file to Label Studio task"""
+    image_file, image_file_base = image_file
+    if image_meta_cache is None:
+        image_meta_cache = _worker_meta_cache
+    task = {
+        "data": {
+            # eg. '../../foo+you.py' -> '../../foo%2Byou.py'
+            "image": image_root_url
+            + str(pathname2url(image_file))
+        }
+    }
+
+    # define coresponding label file and check existence
+    label_file = os.path.join(labels_dir, image_file_base + '.txt')
+    if not os.path.exists(label_file):
+        return task
+
+    task[out_type] = [
+        {
+            "result": [],
+            "ground_truth": False,
+        }
+    ]
+
+    # read image sizes
+    if image_dims is None:
+        # default to reading image header if we aren't given image dims
+        image_path = os.path.join(images_dir, image_file)
+        if image_meta_cache is not None:
+            image_width, image_height, _ = image_meta_cache.probe(image_path)
+        else:
+            image_width, image_height = get_image_size(image_path)
+    else:
+        image_width, image_height = image_dims
+
+    # convert all bounding boxes to Label Studio Results
+    for values in _read_labels(label_file):
+        label_id, x, y, width, height = values[0:5]
+        score = values[5] if len(values) >= 6 else None
+        item = {
+            "id": uuid.uuid4().hex[0:10],
+            "type": "rectanglelabels",
+            "value": {
+                "x": (x - width / 2) * 100,
+                "y": (y - height / 2) * 100,
+                "width": width * 100,
+                "height": height * 100,
+                "rotation": 0,
+                "rectanglelabels": [categories[int(label_id)]],
+            },
+            "to_name": to_name,
+            "from_name": from_name,
+            "image_rotation": 0,
+            "original_width": image_width,
+            "original_height": image_height,
+        }
+        if score:
+            item["score"] = score
+        task[out_type][0]['result'].append(item)
+    return task
+
+
 def convert_yolo_to_ls(
     input_dir,
     out_file,
@@ -26,6 +127,11 @@ def convert_yolo_to_ls(
     image_root_url=default_image_root_url,
     image_ext='.jpg,.jpeg,.png',
     image_dims: Optional[Tuple[int, int]] = None,
+    image_meta_cache=None,
+    workers=1,
+    out_format='json',
+    shard_size=None,
+    shard_bytes=None,
 ):
     """Convert YOLO labeling to Label Studio JSON
     :param input_dir: directory with YOLO where images, labels, notes.json are located
@@ -36,9 +142,13 @@ def convert_yolo_to_ls(
     :param image_root_url: root URL path where images will be hosted, e.g.: http://example.com/images
     :param image_ext: image extension/s - single string or comma separated list to search, eg. .jpeg or .jpg, .png and so on.
     :param image_dims: image dimensions - optional tuple of integers specifying the image width and height of *all* images in the dataset. Defaults to opening the image to determine it's width and height, which is slower. This should only be used in the special case where you dataset has uniform image dimesions.
+    :param image_meta_cache: path to SQLite file to keep image sizes between conversions, see cache.ImageMetaCache
+    :param workers: number of processes to read label files and image sizes, 1 converts images in this process
+    :param out_format: "json" or "jsonl", see task_writer.TaskWriter
+    :param shard_size: split output to files with this number of tasks
+    :param shard_bytes: split output to files of this size in bytes
     """
 
-    tasks = []
     logger.info('Reading YOLO notes and categories from %s', input_dir)
 
     # build categories=>labels dict
@@ -48,8 +158,10 @@ def convert_yolo_to_ls(
     categories = {i: line for i, line in enumerate(lines)}
     logger.info(f'Found {len(categories)} categories')
 
+    writer = TaskWriter(out_file, out_format, shard_size, shard_bytes)
+
     # generate and save labeling config
-    label_config_file = out_file.replace('.json', '') + '.label_config.xml'
+    label_config_file = writer.base + '.label_config.xml'
     generate_label_config(
         categories,
         {from_name: 'RectangleLabels'},
@@ -66,87 +178,53 @@ def convert_yolo_to_ls(
     # build array out of provided comma separated image_extns (str -> array)
     image_ext = [x.strip() for x in image_ext.split(",")]
     logger.info(f'image extensions->, {image_ext}')
+    image_root_url += '' if image_root_url.endswith('/') else '/'
 
-    # loop through images
+    # collect images with known extensions
+    image_files = []
     for f in os.listdir(images_dir):
-        image_file_found_flag = False
         for ext in image_ext:
             if f.endswith(ext):
-                image_file = f
-                image_file_base = f[0 : -len(ext)]
-                image_file_found_flag = True
+                image_files.append((f, f[0 : -len(ext)]))
                 break
-        if not image_file_found_flag:
-            continue
-
-        image_root_url += '' if image_root_url.endswith('/') else '/'
-        task = {
-            "data": {
-                # eg. '../../foo+you.py' -> '../../foo%2Byou.py'
-                "image": image_root_url
-                + str(pathname2url(image_file))
-            }
-        }
 
-        # define coresponding label file and check existence
-        label_file = os.path.join(labels_dir, image_file_base + '.txt')
-
-        if os.path.exists(label_file):
-            task[out_type] = [
-                {
-                    "result": [],
-                    "ground_truth": False,
-                }
-            ]
-
-            # read image sizes
-            if image_dims is None:
-                # default to opening file if we aren't given image dims. slow!
-                with Image.open(os.path.join(images_dir, image_file)) as im:
-                    image_width, image_height = im.size
-            else:
-                image_width, image_height = image_dims
-
-            with open(label_file) as file:
-                # convert all bounding boxes to Label Studio Results
-                lines = file.readlines()
-                for line in lines:
-                    values = line.split()
-                    label_id, x, y, width, height = values[0:5]
-                    score = float(values[5]) if len(values) >= 6 else None
-                    x, y, width, height = (
-                        float(x),
-                        float(y),
-                        float(width),
-                        float(height),
-                    )
-                    item = {
-                        "id": uuid.uuid4().hex[0:10],
-                        "type": "rectanglelabels",
-                        "value": {
-                            "x": (x - width / 2) * 100,
-                            "y": (y - height / 2) * 100,
-                            "width": width * 100,
-                            "height": height * 100,
-                            "rotation": 0,
-                            "rectanglelabels": [categories[int(label_id)]],
-                        },
-                        "to_name": to_name,
-                        "from_name": from_name,
-                        "image_rotation": 0,
-                        "original_width": image_width,
-                        "original_height": image_height,
-                    }
-                    if score:
-                        item["score"] = score
-                    task[out_type][0]['result'].append(item)
-
-        tasks.append(task)
-
-    if len(tasks) > 0:
-        logger.info('Saving Label Studio JSON to %s', out_file)
-        with open(out_file, 'w') as out:
-            json.dump(tasks, out)
+    convert_image = functools.partial(
+        _convert_image,
+        images_dir=images_dir,
+        labels_dir=labels_dir,
+        categories=categories,
+        to_name=to_name,
+        from_name=from_name,
+        out_type=out_type,
+        image_root_url=image_root_url,
+        image_dims=image_dims,
+    )
+    with writer:
+        if workers > 1:
+            # worker processes open their own connection to the image metadata cache
+            if isinstance(image_meta_cache, ImageMetaCache):
+                image_meta_cache = image_meta_cache.db_path
+            chunksize = max(1, min(1024, len(image_files) // (workers * 4)))
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(image_meta_cache,),
+            ) as executor:
+                # map() keeps the order of images, so the output is the same as in serial mode
+                for task in executor.map(
+                    convert_image, image_files, chunksize=chunksize
+                ):
+                    writer.write(task)
+        else:
+            if isinstance(image_meta_cache, str):
+                image_meta_cache = ImageMetaCache(image_meta_cache)
+            for image_file in image_files:
+                writer.write(
+                    convert_image(image_file, image_meta_cache=image_meta_cache)
+                )
+
+    if writer.count > 0:
+        logger.info('Saved Label Studio JSON to %s', writer.describe())
 
         help_root_dir = ''
         if image_root_url == default_image_root_url:
@@ -165,7 +243,7 @@ def convert_yolo_to_ls(
             f'       https://labelstud.io/guide/storage.html#Local-storage\n'
             f'       See tutorial here:\nhttps://github.com/HumanSignal/label-studio-converter/tree/master?tab=readme-ov-file#yolo-to-label-studio-converter\n'
             f'       {help_root_dir}\n'
-            f'  4. Import "{out_file}" to the project\n'
+            f'  4. Import {writer.describe()} to the project\n'
         )
     else:
         logger.error('No labels converted')
@@ -234,3 +312,17 @@ def add_parser(subparsers):
         ),
         default=None,
     )
+    yolo.add_argument(
+        '--image-meta-cache',
+        dest='image_meta_cache',
+        help='SQLite file to keep image sizes between conversions, images are read only when they change',
+        default=None,
+    )
+    yolo.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        help='number of processes to read label files and image sizes',
+        default=1,
+    )
+    add_writer_args(yolo)
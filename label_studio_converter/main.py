@@ -4,9 +4,18 @@ import logging
 import argparse
 
 from label_studio_converter.converter import Converter, Format, FormatNotSupportedError
+from label_studio_converter.cache import DownloadCache
 from label_studio_converter.exports.csv import ExportToCSV
-from label_studio_converter.utils import ExpandFullPath
-from label_studio_converter.imports import yolo as import_yolo, coco as import_coco
+from label_studio_converter.utils import (
+    ExpandFullPath,
+    MATERIALIZE_STRATEGIES,
+    SPAN_TOKENIZERS,
+)
+from label_studio_converter.imports import (
+    yolo as import_yolo,
+    coco as import_coco,
+    masks as import_masks,
+)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -69,6 +78,82 @@ def get_export_args(parser):
         default=None,
         help='Label Studio project directory path',
     )
+    parser.add_argument(
+        '--prefetch-size',
+        dest='prefetch_size',
+        type=int,
+        default=0,
+        help='How many next items should have their images or audio downloaded in background threads '
+        'while the current item is converted (0 disables prefetching)',
+    )
+    parser.add_argument(
+        '--download-cache',
+        dest='download_cache',
+        default=None,
+        help='Directory with persistent cache of downloaded images and audio, it is reused between exports',
+        action=ExpandFullPath,
+    )
+    parser.add_argument(
+        '--download-cache-size',
+        dest='download_cache_size',
+        type=int,
+        default=DownloadCache.DEFAULT_MAX_SIZE // 1024**2,
+        help='Max size of the download cache in megabytes, least recently used files are evicted',
+    )
+    parser.add_argument(
+        '--materialize',
+        dest='materialize_strategy',
+        choices=MATERIALIZE_STRATEGIES,
+        default='copy',
+        help='How to put local and cached images or audio to the output: hardlink, reflink and symlink '
+        'don\'t duplicate data on disk, copy is used as a fallback when linking is not possible; '
+        'symlinks to --download-cache files break when the files are evicted',
+    )
+    parser.add_argument(
+        '--file-index',
+        dest='file_index',
+        default=None,
+        help='JSON file with the listing of the upload dir, it is created on the first export and reused '
+        'by the next ones to avoid checking every file on slow file systems',
+        action=ExpandFullPath,
+    )
+    parser.add_argument(
+        '--image-meta-cache',
+        dest='image_meta_cache',
+        default=None,
+        help='SQLite file to keep image sizes between exports, images are read only when they change',
+        action=ExpandFullPath,
+    )
+    parser.add_argument(
+        '--no-download',
+        dest='download_resources',
+        action='store_false',
+        default=True,
+        help='Don\'t download or copy images and audio to the output, only file paths are exported',
+    )
+    parser.add_argument(
+        '--metadata-first',
+        dest='metadata_first',
+        action='store_true',
+        default=False,
+        help='Take image sizes for COCO from original_width and original_height of regions, '
+        'images are opened only when regions don\'t have them; use with --no-download to skip image I/O',
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=1,
+        help='Number of processes for CPU heavy exports (brush masks, CONLL2003)',
+    )
+    parser.add_argument(
+        '--tokenizer',
+        dest='tokenizer',
+        choices=list(SPAN_TOKENIZERS),
+        default='treebank',
+        help='Tokenizer for CONLL2003 export: treebank is compatible with previous exports, '
+        'whitespace and wordpunct split by regex and are much faster',
+    )
     parser.add_argument(
         '--heartex-format',
         dest='heartex_format',
@@ -98,12 +183,30 @@ def get_all_args():
     import_format = parser_import.add_subparsers(dest='import_format')
     import_yolo.add_parser(import_format)
     import_coco.add_parser(import_format)
+    import_masks.add_parser(import_format)
 
     return parser.parse_args()
 
 
 def export(args):
-    c = Converter(args.config, project_dir=args.project_dir)
+    download_cache = None
+    if args.download_cache:
+        download_cache = DownloadCache(
+            args.download_cache, max_size=args.download_cache_size * 1024**2
+        )
+    c = Converter(
+        args.config,
+        project_dir=args.project_dir,
+        download_resources=args.download_resources,
+        prefetch_size=args.prefetch_size,
+        download_cache=download_cache,
+        materialize_strategy=args.materialize_strategy,
+        file_index=args.file_index,
+        image_meta_cache=args.image_meta_cache,
+        metadata_first=args.metadata_first,
+        workers=args.workers,
+        tokenizer=args.tokenizer,
+    )
 
     if args.format == Format.JSON:
         c.convert_to_json(args.input, args.output)
@@ -153,6 +256,14 @@ def export(args):
         c.convert_to_yolo(args.input, args.output, is_dir=not args.heartex_format)
     elif args.format == Format.YOLO_OBB:
         c.convert_to_yolo(args.input, args.output, is_dir=not args.heartex_format, is_obb=True)
+    elif args.format in (
+        Format.BRUSH_TO_NUMPY,
+        Format.BRUSH_TO_PNG,
+        Format.BRUSH_TO_INDEXED_PNG,
+        Format.BRUSH_TO_INDEXED_NPZ,
+        Format.BRUSH_TO_MEMMAP,
+    ):
+        c.convert(args.input, args.output, args.format, is_dir=not args.heartex_format)
     else:
         raise FormatNotSupportedError()
 
@@ -167,6 +278,11 @@ def imports(args):
             out_type=args.out_type,
             image_root_url=args.image_root_url,
             image_ext=args.image_ext,
+            image_meta_cache=args.image_meta_cache,
+            workers=args.workers,
+            out_format=args.out_format,
+            shard_size=args.shard_size,
+            shard_bytes=args.shard_bytes,
         )
 
     elif args.import_format == 'coco':
@@ -178,6 +294,30 @@ def imports(args):
             out_type=args.out_type,
             image_root_url=args.image_root_url,
             point_width=args.point_width,
+            max_in_memory=args.max_in_memory,
+            out_format=args.out_format,
+            shard_size=args.shard_size,
+            shard_bytes=args.shard_bytes,
+        )
+
+    elif args.import_format == 'masks':
+        import_masks.convert_masks_to_ls(
+            input_dir=args.input,
+            out_file=args.output,
+            label_map=args.label_map,
+            label=args.label,
+            to_name=args.to_name,
+            from_name=args.from_name,
+            out_type=args.out_type,
+            image_root_url=args.image_root_url,
+            mask_ext=args.mask_ext,
+            image_ext=args.image_ext,
+            model_version=args.model_version,
+            score=args.score,
+            workers=args.workers,
+            out_format=args.out_format,
+            shard_size=args.shard_size,
+            shard_bytes=args.shard_bytes,
         )
     else:
         raise FormatNotSupportedError()
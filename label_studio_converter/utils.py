@@ -1,5 +1,6 @@
 import io
 import os
+import json
 import requests
 import hashlib
 import logging
@@ -9,17 +10,22 @@ import wave
 import shutil
 import argparse
 import re
-import datetime
 import math
+import time
+import threading
+import bisect
 
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from operator import itemgetter
-from PIL import Image
 from urllib.parse import urlparse
 from nltk.tokenize.treebank import TreebankWordTokenizer
 from lxml import etree
 from collections import defaultdict
 from label_studio_tools.core.utils.params import get_env
+from label_studio_converter.image_probe import probe_image
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +36,21 @@ _NOT_CONTROL_TAGS = {
 LOCAL_FILES_DOCUMENT_ROOT = get_env(
     'LOCAL_FILES_DOCUMENT_ROOT', default=os.path.abspath(os.sep)
 )
+# guards output filename selection when downloads run in parallel threads
+_download_lock = threading.Lock()
+# output paths of downloads in progress, guarded by _download_lock
+_reserved_paths = set()
+# ways to put local files into the export directory, see materialize()
+MATERIALIZE_STRATEGIES = ('copy', 'hardlink', 'reflink', 'symlink')
+# FICLONE ioctl request code from linux/fs.h
+_FICLONE = 0x40049409
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 0.5
+DOWNLOAD_TIMEOUT = 60
+# number of task texts with token spans kept in memory, see token_spans();
+# annotations of one task come one after another, so a few entries are enough
+TOKEN_CACHE_SIZE = 8
 
 TreebankWordTokenizer.PUNCTUATION = [
     (re.compile(r"([:,])([^\d])"), r" \1 \2"),
@@ -44,6 +65,19 @@ TreebankWordTokenizer.PUNCTUATION = [
     (re.compile(r"([^'])' "), r"\1 ' "),
 ]
 
+# one tokenizer instance per process, it has no state between calls
+_treebank_tokenizer = TreebankWordTokenizer()
+_whitespace_re = re.compile(r'\S+')
+_wordpunct_re = re.compile(r'\w+|[^\w\s]+')
+
+# span tokenizers for CONLL export: text => iterable of (start, end) character offsets,
+# "treebank" is compatible with previous exports, regex tokenizers are much faster
+SPAN_TOKENIZERS = {
+    'treebank': _treebank_tokenizer.span_tokenize,
+    'whitespace': lambda text: (m.span() for m in _whitespace_re.finditer(text)),
+    'wordpunct': lambda text: (m.span() for m in _wordpunct_re.finditer(text)),
+}
+
 
 class ExpandFullPath(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
@@ -62,60 +96,99 @@ def tokenize(text):
     return out
 
 
-def create_tokens_and_tags(text, spans):
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def token_spans(text, tokenizer='treebank'):
+    """Tokenize text and return tuple of (start, end) token offsets
+
+    The last TOKEN_CACHE_SIZE results are cached by text, so consecutive annotations
+    of the same task are tokenized once.
+
+    :param text: text to tokenize
+    :param tokenizer: name from SPAN_TOKENIZERS or function text => iterable of (start, end)
+    """
+    if not callable(tokenizer):
+        if tokenizer not in SPAN_TOKENIZERS:
+            raise ValueError(
+                f'Unknown tokenizer {tokenizer}, use one of {list(SPAN_TOKENIZERS)}'
+            )
+        tokenizer = SPAN_TOKENIZERS[tokenizer]
+    return tuple(tokenizer(text))
+
+
+def create_tokens_and_tags(text, spans, tokenizer='treebank'):
+    """Tokenize text and assign BIO tags from labeled spans
+
+    Span boundaries are mapped to token indices with bisect over token offsets,
+    so the cost is O((tokens + spans) * log(tokens)). The rules are kept from
+    the original token by token walk:
+    - spans are sorted by start, the first span is current;
+    - a token is tagged by the current span if it overlaps [start, end - 1];
+    - the next span becomes current when a token starts after the current span end,
+      spans which end before this token are skipped;
+    - the first tagged token of a span gets B-, the next ones I-.
+
+    :param text: text to tokenize
+    :param spans: list of results with start, end and labels
+    :param tokenizer: see token_spans()
+    :return: tokens, tags
+    """
     # tokens_and_idx = tokenize(text) # This function doesn't work properly if text contains multiple whitespaces...
-    token_index_tuples = [
-        token for token in TreebankWordTokenizer().span_tokenize(text)
-    ]
-    tokens_and_idx = [(text[start:end], start) for start, end in token_index_tuples]
-    if spans and all(
-        [
-            span.get('start') is not None and span.get('end') is not None
-            for span in spans
-        ]
+    offsets = token_spans(text, tokenizer)
+    tokens = [text[start:end] for start, end in offsets]
+    tags = ['O'] * len(tokens)
+    if not spans or not all(
+        span.get('start') is not None and span.get('end') is not None
+        for span in spans
     ):
-        spans = list(sorted(spans, key=itemgetter('start')))
-        span = spans.pop(0)
-        span_start = span['start']
-        span_end = span['end'] - 1
-        prefix = 'B-'
-        tokens, tags = [], []
-        for token, token_start in tokens_and_idx:
-            tokens.append(token)
-            token_end = (
-                token_start + len(token) - 1
-            )  # "- 1" - This substraction is wrong. token already uses the index E.g. "Hello" is 0-4
-            token_start_ind = token_start  # It seems like the token start is too early.. for whichever reason
-
-            # if for some reason end of span is missed.. pop the new span (Which is quite probable due to this method)
-            # Attention it seems like span['end'] is the index of first char afterwards. In case the whitespace is part of the
-            # labell we need to subtract one. Otherwise next token won't trigger the span update.. only the token after next..
-            if token_start_ind > span_end:
-                while spans:
-                    span = spans.pop(0)
-                    span_start = span['start']
-                    span_end = span['end'] - 1
-                    prefix = 'B-'
-                    if token_start <= span_end:
-                        break
-            # Add tag "O" for spans that:
-            # - are empty
-            # - span start has passed over token_end
-            # - do not have any label (None or empty list)
-            if not span or token_end < span_start or not span.get('labels'):
-                tags.append('O')
-            elif span_start <= token_end and span_end >= token_start_ind:
-                tags.append(prefix + span['labels'][0])
-                prefix = 'I-'
-            else:
-                tags.append('O')
-    else:
-        tokens = [token for token, _ in tokens_and_idx]
-        tags = ['O'] * len(tokens)
+        return tokens, tags
+
+    spans = sorted(spans, key=itemgetter('start'))
+    token_starts = [start for start, _ in offsets]
+    # the last char index of tokens, span ends are converted the same way
+    token_ends = [end - 1 for _, end in offsets]
+    count = len(tokens)
+    pos, index = 0, 0
+    while pos < count:
+        span = spans[index]
+        span_start, span_end = span['start'], span['end'] - 1
+        # tokens [pos, stop) start before the span end
+        stop = bisect.bisect_right(token_starts, span_end, pos)
+        # and tokens [first, stop) end after the span start
+        first = bisect.bisect_left(token_ends, span_start, pos, stop)
+        labels = span.get('labels')
+        if labels and first < stop:
+            tags[first] = 'B-' + labels[0]
+            tags[first + 1 : stop] = ['I-' + labels[0]] * (stop - first - 1)
+        pos = stop
+        if pos >= count:
+            break
+        # skip spans which end before the next token
+        index += 1
+        while index < len(spans) and spans[index]['end'] - 1 < token_starts[pos]:
+            index += 1
+        if index >= len(spans):
+            break
 
     return tokens, tags
 
 
+def conll_document(text, spans, tokenizer='treebank'):
+    """CONLL2003 lines of one document: "token -X- _ tag" per token and an empty line at the end"""
+    tokens, tags = create_tokens_and_tags(text, spans, tokenizer)
+    return (
+        ''.join(
+            '{token} -X- _ {tag}\n'.format(token=token, tag=tag)
+            for token, tag in zip(tokens, tags)
+        )
+        + '\n'
+    )
+
+
+def conll_documents(documents, tokenizer='treebank'):
+    """List of (text, spans) to CONLL2003 documents, it's a unit of work for export processes"""
+    return [conll_document(text, spans, tokenizer) for text, spans in documents]
+
+
 def _get_upload_dir(project_dir=None, upload_dir=None):
     """Return either upload_dir, or path by LS_UPLOAD_DIR, or project_dir/upload"""
     if upload_dir:
@@ -132,6 +205,308 @@ def _get_upload_dir(project_dir=None, upload_dir=None):
     return upload_dir
 
 
+class LocalFileIndex(object):
+    """Resolves Label Studio upload and local-files urls to local paths
+
+    Directory listings are read with os.scandir once per directory and kept
+    in memory, so checking millions of files costs one syscall per directory
+    instead of a stat per file. The upload dir can be scanned eagerly and the
+    listings persisted to index_file to be reused by the next exports.
+    """
+
+    def __init__(
+        self,
+        project_dir=None,
+        upload_dir=None,
+        document_root=LOCAL_FILES_DOCUMENT_ROOT,
+        index_file=None,
+    ):
+        """
+        :param project_dir: Label Studio project dir, its "upload" subdir is the upload dir by default
+        :param upload_dir: upload dir, see _get_upload_dir()
+        :param document_root: LOCAL_FILES_DOCUMENT_ROOT for local-files urls
+        :param index_file: JSON file with persisted listings, it's created by scanning the upload dir if missing
+        """
+        self.project_dir = project_dir
+        self.document_root = document_root
+        self.index_file = index_file
+        self._upload_dir = upload_dir
+        self._upload_dir_resolved = False
+        self._listings = {}  # dir path => set of file names
+        self._lock = threading.Lock()
+        if index_file and os.path.exists(index_file):
+            self.load(index_file)
+
+    @property
+    def upload_dir(self):
+        if not self._upload_dir_resolved:
+            self._upload_dir = _get_upload_dir(self.project_dir, self._upload_dir)
+            self._upload_dir_resolved = True
+            if self.index_file and not os.path.exists(self.index_file):
+                self.scan(self._upload_dir)
+                self.save(self.index_file)
+        return self._upload_dir
+
+    def _listing(self, dir_path):
+        listing = self._listings.get(dir_path)
+        if listing is None:
+            with self._lock:
+                listing = self._listings.get(dir_path)
+                if listing is None:
+                    try:
+                        with os.scandir(dir_path) as entries:
+                            listing = {e.name for e in entries if not e.is_dir()}
+                    except (FileNotFoundError, NotADirectoryError):
+                        listing = set()
+                    self._listings[dir_path] = listing
+        return listing
+
+    def exists(self, path):
+        dir_path, name = os.path.split(path)
+        listing = self._listing(dir_path)
+        if name in listing:
+            return True
+        # listings don't know about files added after they were read, a miss costs one stat
+        if os.path.exists(path):
+            with self._lock:
+                listing.add(name)
+            return True
+        return False
+
+    def scan(self, root):
+        """Read listings of root and all its subdirs"""
+        stack = [root]
+        while stack:
+            dir_path = stack.pop()
+            names = set()
+            try:
+                with os.scandir(dir_path) as entries:
+                    for e in entries:
+                        if e.is_dir():
+                            stack.append(e.path)
+                        else:
+                            names.add(e.name)
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            with self._lock:
+                self._listings[dir_path] = names
+
+    def save(self, index_file):
+        with self._lock:
+            listings = {d: sorted(names) for d, names in self._listings.items()}
+        with io.open(index_file, mode='w', encoding='utf8') as f:
+            json.dump(listings, f)
+
+    def load(self, index_file):
+        with io.open(index_file, encoding='utf8') as f:
+            listings = json.load(f)
+        with self._lock:
+            for dir_path, names in listings.items():
+                self._listings[dir_path] = set(names)
+
+    def resolve(self, url):
+        """Return local path for /data/upload/... and /data/local-files/?d=... urls, None for others
+
+        :raise FileNotFoundError: if the file doesn't exist
+        """
+        if url.startswith('/data/upload'):
+            filename = urllib.parse.unquote(url.replace('/data/upload/', ''))
+            filepath = os.path.join(self.upload_dir, filename)
+        elif url.startswith('/data/') and '?d=' in url:
+            dir_path = url.split('/data/', 1)[-1].split('?d=')[1]
+            dir_path = str(urllib.parse.unquote(dir_path))
+            filepath = os.path.join(self.document_root, dir_path)
+        else:
+            return None
+        if not self.exists(filepath):
+            raise FileNotFoundError(filepath)
+        return filepath
+
+
+def verify_checksum(filepath, checksum):
+    """Check file against checksum string "<algorithm>:<hex digest>", e.g. "sha256:9f86d0..."
+
+    :raise ValueError: if the digest doesn't match
+    """
+    algorithm, expected = checksum.split(':', 1)
+    h = hashlib.new(algorithm)
+    with io.open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            h.update(chunk)
+    if h.hexdigest().lower() != expected.lower():
+        raise ValueError(
+            f'Checksum mismatch for {filepath}: expected {checksum}, got {algorithm}:{h.hexdigest()}'
+        )
+
+
+def fetch_url(
+    url,
+    filepath,
+    headers=None,
+    checksum=None,
+    retries=DOWNLOAD_RETRIES,
+    backoff=DOWNLOAD_BACKOFF,
+    chunk_size=DOWNLOAD_CHUNK_SIZE,
+    timeout=DOWNLOAD_TIMEOUT,
+):
+    """Stream url to filepath chunk by chunk without keeping the body in memory
+
+    The body is written to <filepath>.part first. If the connection drops,
+    the download is retried with exponential backoff and resumed from the
+    already received bytes using an HTTP Range request. When the retries run out,
+    <filepath>.part is kept (with the ETag or Last-Modified of the response
+    in <filepath>.part.validator), so the next call resumes it. The partial file
+    is removed on checksum mismatch and on non-retryable HTTP errors.
+    The file is moved to filepath only when it's complete (and matches the checksum).
+
+    :param url: http(s) url
+    :param filepath: where to save the file
+    :param headers: additional request headers, e.g. conditional ones
+    :param checksum: optional "<algorithm>:<hex digest>" to verify the file, e.g. "md5:..."
+    :param retries: how many times to retry on connection errors and 5xx/429 responses
+    :param backoff: delay before the first retry in seconds, doubled for each next one
+    :param chunk_size: size of chunks to write
+    :param timeout: connect and read timeout in seconds
+    :return: the last response; nothing is written for "304 Not Modified"
+    """
+    part_path = filepath + '.part'
+    validator_path = part_path + '.validator'
+    validator = None
+    if os.path.exists(part_path) and os.path.exists(validator_path):
+        with io.open(validator_path) as f:
+            validator = f.read() or None
+
+    try:
+        for attempt in range(retries + 1):
+            request_headers = dict(headers or {})
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if offset:
+                request_headers['Range'] = f'bytes={offset}-'
+                if validator:
+                    # server sends the whole file if it has changed since the first attempt
+                    request_headers['If-Range'] = validator
+
+            try:
+                with requests.get(
+                    url, headers=request_headers, stream=True, timeout=timeout
+                ) as r:
+                    if r.status_code == 304:
+                        return r
+                    if _is_retryable(r.status_code) and attempt < retries:
+                        raise requests.ConnectionError(
+                            f'{r.status_code} response', response=r
+                        )
+                    r.raise_for_status()
+                    mode = 'ab' if r.status_code == 206 else 'wb'
+                    if mode == 'wb':
+                        validator = r.headers.get('ETag') or r.headers.get(
+                            'Last-Modified'
+                        )
+                        with io.open(validator_path, mode='w') as f:
+                            f.write(validator or '')
+                    with io.open(part_path, mode=mode) as fout:
+                        for chunk in r.iter_content(chunk_size=chunk_size):
+                            fout.write(chunk)
+                break
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                if attempt >= retries:
+                    raise
+                delay = backoff * 2**attempt
+                logger.info(
+                    f'Download of {url} failed ({e}), retry in {delay} seconds'
+                )
+                time.sleep(delay)
+    except requests.HTTPError as e:
+        if e.response is None or not _is_retryable(e.response.status_code):
+            remove_partial_download(part_path)
+        raise
+
+    if checksum:
+        try:
+            verify_checksum(part_path, checksum)
+        except ValueError:
+            remove_partial_download(part_path)
+            raise
+    os.replace(part_path, filepath)
+    remove_partial_download(part_path)
+    return r
+
+
+def _is_retryable(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def remove_partial_download(part_path):
+    """Remove partial download and its validator written by fetch_url()"""
+    for path in (part_path, part_path + '.validator'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _reflink(src, dst):
+    """Clone src to dst sharing data blocks (copy-on-write), Linux btrfs/xfs only"""
+    import fcntl
+
+    with io.open(src, 'rb') as fsrc, io.open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def materialize(src, dst, strategy='copy'):
+    """Put local file src to dst using hardlink, reflink, symlink or copy
+
+    Links are much faster than copying and don't take extra disk space, but
+    hardlinked and symlinked files share their content with the source.
+    If the strategy fails (e.g. hardlink across devices, reflink on a file system
+    without copy-on-write support), the file is copied.
+
+    :param src: source file path
+    :param dst: destination file path or directory
+    :param strategy: one of MATERIALIZE_STRATEGIES
+    :return: destination file path
+    """
+    if strategy not in MATERIALIZE_STRATEGIES:
+        raise ValueError(
+            f'Unknown materialize strategy "{strategy}", use one of {MATERIALIZE_STRATEGIES}'
+        )
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return dst
+    if os.path.islink(dst):
+        os.remove(dst)
+
+    if strategy != 'copy':
+        try:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            if strategy == 'hardlink':
+                os.link(src, dst)
+            elif strategy == 'symlink':
+                os.symlink(os.path.abspath(src), dst)
+            else:
+                _reflink(src, dst)
+            return dst
+        except (OSError, ImportError) as e:
+            logger.debug(f'Can\'t {strategy} {src} to {dst}, copy it instead: {e}')
+
+    shutil.copy(src, dst)
+    return dst
+
+
+def _path_taken(filepath):
+    """Check if filepath exists or is reserved by a download in progress, call under _download_lock"""
+    return filepath in _reserved_paths or os.path.exists(filepath)
+
+
 def download(
     url,
     output_dir,
@@ -140,21 +515,37 @@ def download(
     return_relative_path=False,
     upload_dir=None,
     download_resources=True,
+    cache=None,
+    materialize_strategy='copy',
+    checksum=None,
+    file_index=None,
 ):
+    """Download or copy resource by Label Studio url to output_dir
+
+    :param cache: optional DownloadCache to reuse files downloaded by previous runs
+    :param materialize_strategy: how to put local and cached files to output_dir:
+                                 copy, hardlink, reflink or symlink, see materialize()
+    :param checksum: optional "<algorithm>:<hex digest>" to verify the downloaded file
+    :param file_index: optional LocalFileIndex to resolve upload and local-files urls without per-file syscalls
+    """
     is_local_file = url.startswith('/data/') and '?d=' in url
     is_uploaded_file = url.startswith('/data/upload')
 
     if is_uploaded_file:
-        upload_dir = _get_upload_dir(project_dir, upload_dir)
-        filename = urllib.parse.unquote(url.replace('/data/upload/', ''))
-        filepath = os.path.join(upload_dir, filename)
+        if file_index is not None:
+            filepath = file_index.resolve(url)
+            filename = os.path.basename(filepath)
+        else:
+            upload_dir = _get_upload_dir(project_dir, upload_dir)
+            filename = urllib.parse.unquote(url.replace('/data/upload/', ''))
+            filepath = os.path.join(upload_dir, filename)
         logger.debug(
             f'Copy {filepath} to {output_dir}'.format(
                 filepath=filepath, output_dir=output_dir
             )
         )
         if download_resources:
-            shutil.copy(filepath, output_dir)
+            materialize(filepath, output_dir, materialize_strategy)
         if return_relative_path:
             return os.path.join(
                 os.path.basename(output_dir), os.path.basename(filename)
@@ -162,51 +553,117 @@ def download(
         return filepath
 
     if is_local_file:
-        filename, dir_path = url.split('/data/', 1)[-1].split('?d=')
-        dir_path = str(urllib.parse.unquote(dir_path))
-        filepath = os.path.join(LOCAL_FILES_DOCUMENT_ROOT, dir_path)
-        if not os.path.exists(filepath):
-            raise FileNotFoundError(filepath)
+        if file_index is not None:
+            filepath = file_index.resolve(url)
+        else:
+            filename, dir_path = url.split('/data/', 1)[-1].split('?d=')
+            dir_path = str(urllib.parse.unquote(dir_path))
+            filepath = os.path.join(LOCAL_FILES_DOCUMENT_ROOT, dir_path)
+            if not os.path.exists(filepath):
+                raise FileNotFoundError(filepath)
         if download_resources:
-            shutil.copy(filepath, output_dir)
+            materialize(filepath, output_dir, materialize_strategy)
         return filepath
 
-    if filename is None:
-        basename, ext = os.path.splitext(os.path.basename(urlparse(url).path))
-        filename = f'{basename}{ext}'
+    with _download_lock:
+        if filename is None:
+            basename, ext = os.path.splitext(os.path.basename(urlparse(url).path))
+            filename = f'{basename}{ext}'
+            # the same url downloaded again (e.g. once per annotation) gets a new name every time
+            attempt = 0
+            while _path_taken(os.path.join(output_dir, filename)):
+                key = url if attempt == 0 else f'{url}#{attempt}'
+                filename = (
+                    basename + '_' + hashlib.md5(key.encode()).hexdigest()[:4] + ext
+                )
+                attempt += 1
+
         filepath = os.path.join(output_dir, filename)
-        if os.path.exists(filepath):
-            filename = (
-                basename
-                + '_'
-                + hashlib.md5(
-                    url.encode() + str(datetime.datetime.now().timestamp()).encode()
-                ).hexdigest()[:4]
-                + ext
-            )
+        exists = os.path.exists(filepath)
+        if not exists and download_resources:
+            # reserve the filename in memory, so concurrent downloads can't pick it too;
+            # nothing is written to filepath until the file is complete
+            _reserved_paths.add(filepath)
 
-    filepath = os.path.join(output_dir, filename)
-    if not os.path.exists(filepath):
+    if not exists:
         logger.info('Download {url} to {filepath}'.format(url=url, filepath=filepath))
         if download_resources:
-            r = requests.get(url)
-            r.raise_for_status()
-            with io.open(filepath, mode='wb') as fout:
-                fout.write(r.content)
+            try:
+                if cache is not None:
+                    cache.fetch(url, filepath, materialize_strategy, checksum=checksum)
+                else:
+                    fetch_url(url, filepath, checksum=checksum)
+            finally:
+                with _download_lock:
+                    _reserved_paths.discard(filepath)
     if return_relative_path:
         return os.path.join(os.path.basename(output_dir), os.path.basename(filename))
     return filepath
 
 
+class ResourceTable(object):
+    """Per-run table of resolved resources: url => local path and metadata
+
+    Each distinct url is resolved (downloaded, probed, etc) only once,
+    even when several tasks or annotations refer to it and resolving
+    happens in parallel threads.
+    """
+
+    def __init__(self):
+        self._resources = {}
+        self._locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def resolve(self, url, func, *args):
+        """Return func(url, *args), calling it only the first time the url is seen"""
+        with self._lock:
+            lock = self._locks[url]
+        with lock:
+            if url not in self._resources:
+                self._resources[url] = func(url, *args)
+            return self._resources[url]
+
+    def __contains__(self, url):
+        return url in self._resources
+
+    def __len__(self):
+        return len(self._resources)
+
+
+def prefetch(items, func, lookahead=0):
+    """Yield (item, func(item)) pairs keeping the input order
+
+    func is evaluated for up to `lookahead` next items in background threads,
+    so I/O bound work (downloads, image probing) overlaps with the processing
+    of the current item. With lookahead <= 0 everything runs sequentially.
+
+    :param items: iterable with items
+    :param func: function to apply to each item, it should handle its own errors
+    :param lookahead: how many items to resolve ahead of the current one
+    """
+    if lookahead <= 0:
+        for item in items:
+            yield item, func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=lookahead) as executor:
+        queue = deque()
+        for item in items:
+            queue.append((item, executor.submit(func, item)))
+            if len(queue) > lookahead:
+                item, future = queue.popleft()
+                yield item, future.result()
+        while queue:
+            item, future = queue.popleft()
+            yield item, future.result()
+
+
 def get_image_size(image_path):
-    return Image.open(image_path).size
+    return probe_image(image_path)[:2]
 
 
 def get_image_size_and_channels(image_path):
-    i = Image.open(image_path)
-    w, h = i.size
-    c = len(i.getbands())
-    return w, h, c
+    return probe_image(image_path)
 
 
 def get_audio_duration(audio_path):
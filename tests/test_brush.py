@@ -5,7 +5,24 @@ import urllib3
 import json
 import os
 
-from label_studio_converter.brush import encode_rle, image2annotation
+import numpy as np
+import pytest
+
+from PIL import Image
+
+from label_studio_converter import Converter
+from label_studio_converter.brush import (
+    convert_task_dir,
+    convert_task_dir_memmap,
+    decode_rle,
+    decode_rle_channel,
+    encode_rle,
+    get_memmap_mask,
+    image2annotation,
+    iter_rle_channel_rows,
+    load_memmap_masks,
+    mask2rle,
+)
 
 
 def test_image2annotation():
@@ -71,3 +88,228 @@ def test_rle_encoding():
         56,
         32,
     ]
+
+
+def test_rle_decoding():
+    """
+    Decode RLE with literal sequences, short, long and split series
+    """
+    literals = [0, 0, 0, 6, 57, 27, 248, 64, 32, 95, 81, 4, 128]
+    assert decode_rle(literals).tolist() == [1, 2, 250, 9, 9, 9]
+
+    array = np.concatenate(
+        [np.full(n, v, dtype=np.uint8) for n, v in [(1, 3), (7, 255), (16, 0), (300, 1), (70000, 255), (2, 4)]]
+    )
+    decoded = decode_rle(encode_rle(array))
+    assert decoded.dtype == np.uint8
+    assert (decoded == array).all()
+
+
+def test_rle_decoding_truncated():
+    rle = encode_rle(np.repeat(np.arange(8, dtype=np.uint8), 3))
+    with pytest.raises(ValueError):
+        decode_rle(rle[:8])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rle_round_trip(seed):
+    rng = np.random.default_rng(seed)
+    lengths = rng.choice([1, 2, 8, 9, 16, 17, 256, 257, 65536, 65537, 200000], 50)
+    array = np.repeat(rng.integers(0, 256, len(lengths)).astype(np.uint8), lengths)
+    assert (decode_rle(encode_rle(array)) == array).all()
+
+    mask = (rng.random((37, 53)) > 0.7).astype(np.uint8) * 255
+    decoded = decode_rle(mask2rle(mask)).reshape(37, 53, 4)
+    assert (decoded[:, :, 3] == mask).all()
+
+
+def test_rle_encoding_padding():
+    """
+    A zero byte is appended when the bit stream is already aligned to bytes
+    """
+    # 53 header bits + 3 single values * 14 bits + 1 bit of padding
+    assert encode_rle([1, 2, 3]) == [0, 0, 0, 3, 57, 27, 248, 0, 32, 1, 0, 6]
+    # 53 header bits + 2 single values * 14 bits + series of 9 * 15 bits = 96 bits
+    assert encode_rle([1, 2] + [3] * 9) == [0, 0, 0, 11, 57, 27, 248, 0, 32, 1, 88, 3, 0]
+
+
+def test_rle_channel_decoding():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 3, (23, 17, 4)).astype(np.uint8) * 100
+    image[5:15] = 255
+    rle = encode_rle(image.ravel())
+
+    for channel in range(4):
+        assert (decode_rle_channel(rle, channel).reshape(23, 17) == image[:, :, channel]).all()
+
+    bands = list(iter_rle_channel_rows(rle, 17, 23, rows=5))
+    assert [row for row, _ in bands] == [0, 5, 10, 15, 20]
+    assert [band.shape for _, band in bands][-1] == (3, 17)
+    assert (np.concatenate([band for _, band in bands]) == image[:, :, 3]).all()
+
+
+def test_rle_decoding_series_past_end():
+    # 3 values, series of 8 nines
+    assert decode_rle([0, 0, 0, 3, 57, 27, 252, 225, 32]).tolist() == [9, 9, 9]
+
+
+@pytest.mark.parametrize('out_format', ['numpy', 'png'])
+def test_convert_task_dir_parallel(tmp_path, out_format):
+    rng = np.random.default_rng(0)
+    items = []
+    for i in range(10):
+        mask = (rng.random((12, 9)) > 0.5).astype(np.uint8) * 255
+        items.append(
+            {
+                'id': i,
+                'annotation_id': i + 100,
+                'completed_by': {'email': 'user@example.com'},
+                'output': {
+                    'tag': [
+                        {
+                            'type': 'brushlabels',
+                            'rle': mask2rle(mask),
+                            'brushlabels': ['Car'],
+                            'original_width': 9,
+                            'original_height': 12,
+                        }
+                    ]
+                },
+            }
+        )
+
+    outputs = []
+    for workers in (1, 2):
+        out_dir = tmp_path / str(workers)
+        out_dir.mkdir()
+        convert_task_dir(iter(items), str(out_dir), out_format, workers=workers, chunk_size=3)
+        outputs.append({p.name: p.read_bytes() for p in out_dir.iterdir()})
+
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0]) == len(items)
+    assert all(not name.endswith('.tmp') for name in outputs[0])
+
+
+BRUSH_CONFIG = """
+<View>
+  <Image name="image" value="$image"/>
+  <BrushLabels name="tag" toName="image">
+    <Label value="Car"/>
+    <Label value="Airplane"/>
+  </BrushLabels>
+</View>
+"""
+
+
+def brush_result(label, mask):
+    return {
+        'from_name': 'tag',
+        'to_name': 'image',
+        'type': 'brushlabels',
+        'original_width': mask.shape[1],
+        'original_height': mask.shape[0],
+        'value': {'format': 'rle', 'rle': mask2rle(mask), 'brushlabels': [label]},
+    }
+
+
+def write_brush_tasks(tmp_path):
+    """Task with overlapping Car and Airplane brush layers"""
+    car = np.zeros((6, 8), dtype=np.uint8)
+    car[1:4, 1:5] = 255
+    airplane = np.zeros((6, 8), dtype=np.uint8)
+    airplane[3:6, 4:8] = 255
+
+    tasks = [
+        {
+            'id': 1,
+            'data': {'image': 'image.png'},
+            'annotations': [
+                {
+                    'id': 2,
+                    'completed_by': 3,
+                    'result': [brush_result('Car', car), brush_result('Airplane', airplane)],
+                }
+            ],
+        }
+    ]
+    input_file = str(tmp_path / 'tasks.json')
+    with open(input_file, 'w') as f:
+        json.dump(tasks, f)
+    return input_file, car, airplane
+
+
+@pytest.mark.parametrize('out_format', ['BRUSH_TO_INDEXED_PNG', 'BRUSH_TO_INDEXED_NPZ'])
+def test_convert_to_indexed_mask(tmp_path, out_format):
+    input_file, car, airplane = write_brush_tasks(tmp_path)
+    output_dir = tmp_path / 'masks'
+    Converter(BRUSH_CONFIG, str(tmp_path)).convert(
+        input_file, str(output_dir), out_format, is_dir=False
+    )
+
+    with open(output_dir / 'labels.json') as f:
+        assert json.load(f) == {'Airplane': 1, 'Car': 2}
+    expected = np.zeros((6, 8), dtype=np.uint8)
+    expected[car > 0] = 2
+    expected[airplane > 0] = 1  # the last layer is on top
+
+    if out_format == 'BRUSH_TO_INDEXED_PNG':
+        with Image.open(output_dir / 'task-1-annotation-2-by-3.png') as image:
+            assert image.mode == 'P'
+            mask = np.array(image)
+    else:
+        data = np.load(output_dir / 'task-1-annotation-2-by-3.npz')
+        assert data['label_names'].tolist() == ['Airplane', 'Car']
+        assert data['label_ids'].tolist() == [1, 2]
+        mask = data['mask']
+    assert (mask == expected).all()
+
+
+def test_convert_to_memmap(tmp_path):
+    input_file, car, airplane = write_brush_tasks(tmp_path)
+    output_dir = tmp_path / 'masks'
+    Converter(BRUSH_CONFIG, str(tmp_path)).convert(
+        input_file, str(output_dir), 'BRUSH_TO_MEMMAP', is_dir=False
+    )
+
+    masks, index, labels = load_memmap_masks(str(output_dir))
+    assert isinstance(masks, np.memmap)
+    assert labels == ['tag-Car', 'tag-Airplane']
+    assert index['task_id'].tolist() == [1, 1]
+    assert index['annotation_id'].tolist() == [2, 2]
+    assert index['offset'].tolist() == [0, 48]
+    assert (get_memmap_mask(masks, index[0]) == car).all()
+    assert (get_memmap_mask(masks, index[1]) == airplane).all()
+
+
+def test_convert_to_memmap_by_bands(tmp_path):
+    """Masks written by bands of rows are the same as whole masks"""
+    input_file, car, airplane = write_brush_tasks(tmp_path)
+    output_dir = tmp_path / 'masks'
+    output_dir.mkdir()
+    items = Converter(BRUSH_CONFIG, str(tmp_path)).iter_from_json_file(input_file)
+    convert_task_dir_memmap(items, str(output_dir), rows=4)
+
+    masks, index, labels = load_memmap_masks(str(output_dir))
+    assert index['offset'].tolist() == [0, 48]
+    assert (get_memmap_mask(masks, index[0]) == car).all()
+    assert (get_memmap_mask(masks, index[1]) == airplane).all()
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX file modes')
+@pytest.mark.parametrize('out_format', ['BRUSH_TO_NUMPY', 'BRUSH_TO_PNG', 'BRUSH_TO_MEMMAP'])
+def test_brush_export_file_mode(tmp_path, out_format):
+    """Atomically written files get the umask mode like files written directly"""
+    input_file, _, _ = write_brush_tasks(tmp_path)
+    output_dir = tmp_path / 'masks'
+    output_dir.mkdir()
+    umask = os.umask(0o022)
+    try:
+        Converter(BRUSH_CONFIG, str(tmp_path)).convert(
+            input_file, str(output_dir), out_format, is_dir=False
+        )
+    finally:
+        os.umask(umask)
+
+    files = list(output_dir.iterdir())
+    assert files
+    assert all(f.stat().st_mode & 0o777 == 0o644 for f in files)
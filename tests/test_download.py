@@ -0,0 +1,351 @@
+"""
+Tests for resource downloading helpers from utils.py
+"""
+import os
+import time
+import pytest
+import socket
+import hashlib
+import threading
+import requests
+import http.server
+
+from label_studio_converter.cache import DownloadCache
+from label_studio_converter.utils import (
+    download,
+    fetch_url,
+    prefetch,
+    LocalFileIndex,
+    ResourceTable,
+)
+
+
+def test_prefetch_keeps_order():
+    items = list(range(20))
+
+    def slow_square(x):
+        # later items finish first to make sure results are reordered back
+        time.sleep((20 - x) * 0.001)
+        return x * x
+
+    result = list(prefetch(items, slow_square, lookahead=4))
+    assert result == [(x, x * x) for x in items]
+
+
+def test_prefetch_is_bounded():
+    consumed = []
+    started = []
+    lock = threading.Lock()
+
+    def func(x):
+        with lock:
+            started.append(x)
+        return x
+
+    def items():
+        for x in range(100):
+            yield x
+
+    for item, _ in prefetch(items(), func, lookahead=3):
+        consumed.append(item)
+        # never more than lookahead items are resolved ahead of the consumer
+        assert len(started) <= len(consumed) + 3
+
+
+def test_prefetch_sequential():
+    assert list(prefetch([1, 2, 3], str, lookahead=0)) == [(1, '1'), (2, '2'), (3, '3')]
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    """Serves FILES by path with ETag revalidation and Range requests, counts requests.
+    Connection is dropped in the middle of the body DROPS[path] times.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        content = FILES.get(self.path)
+        REQUESTS.append((self.path, dict(self.headers)))
+        if content is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers.get('Range') and self.headers.get('If-Range', etag) == etag:
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header(
+                'Content-Range', f'bytes {start}-{len(content) - 1}/{len(content)}'
+            )
+        else:
+            self.send_response(200)
+        body = content[start:]
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if DROPS.get(self.path):
+            DROPS[self.path] -= 1
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+FILES = {}
+DROPS = {}
+REQUESTS = []
+
+
+@pytest.fixture
+def http_server():
+    FILES.clear()
+    DROPS.clear()
+    REQUESTS.clear()
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def test_download_cache_reuses_files(http_server, tmp_path):
+    FILES['/images/a.jpg'] = b'a' * 1000
+    url = http_server + '/images/a.jpg'
+    cache = DownloadCache(str(tmp_path / 'cache'))
+
+    for run in range(3):
+        output_dir = tmp_path / f'export-{run}'
+        output_dir.mkdir()
+        path = download(url, str(output_dir), cache=cache)
+        assert open(path, 'rb').read() == FILES['/images/a.jpg']
+
+    # the first run downloads, the next ones only revalidate
+    assert len(REQUESTS) == 3
+    assert 'If-None-Match' not in REQUESTS[0][1]
+    assert all('If-None-Match' in headers for _, headers in REQUESTS[1:])
+
+    # changed content is downloaded again
+    FILES['/images/a.jpg'] = b'b' * 1000
+    output_dir = tmp_path / 'export-changed'
+    output_dir.mkdir()
+    path = download(url, str(output_dir), cache=cache)
+    assert open(path, 'rb').read() == FILES['/images/a.jpg']
+
+
+def test_download_cache_evicts_lru(http_server, tmp_path):
+    cache = DownloadCache(str(tmp_path / 'cache'), max_size=2500)
+    output_dir = tmp_path / 'export'
+    output_dir.mkdir()
+    for name in 'abc':
+        FILES[f'/{name}.png'] = name.encode() * 1000
+        download(http_server + f'/{name}.png', str(output_dir), cache=cache)
+
+    objects = [f for _, _, files in os.walk(tmp_path / 'cache' / 'objects') for f in files]
+    assert len(objects) == 2
+    assert cache._lookup(http_server + '/a.png') is None
+    assert cache._lookup(http_server + '/c.png') is not None
+
+
+@pytest.mark.parametrize('strategy', ['copy', 'hardlink', 'reflink', 'symlink'])
+def test_download_uploaded_file_materialize(tmp_path, strategy):
+    upload_dir = tmp_path / 'upload'
+    (upload_dir / '1').mkdir(parents=True)
+    src = upload_dir / '1' / 'image.jpg'
+    src.write_bytes(b'image')
+    output_dir = tmp_path / 'images'
+    output_dir.mkdir()
+
+    for _ in range(2):  # the second export overwrites the file
+        path = download(
+            '/data/upload/1/image.jpg',
+            str(output_dir),
+            upload_dir=str(upload_dir),
+            return_relative_path=True,
+            materialize_strategy=strategy,
+        )
+    dst = tmp_path / path
+    assert dst.read_bytes() == b'image'
+    assert os.path.islink(dst) == (strategy == 'symlink')
+    if strategy == 'hardlink':
+        assert os.stat(dst).st_ino == os.stat(src).st_ino
+    if strategy in ('copy', 'reflink'):
+        assert os.stat(dst).st_ino != os.stat(src).st_ino
+
+
+def test_fetch_url_resumes_dropped_download(http_server, tmp_path):
+    content = os.urandom(3 * 1024 * 1024)
+    FILES['/video.mp4'] = content
+    DROPS['/video.mp4'] = 2
+    filepath = str(tmp_path / 'video.mp4')
+
+    checksum = 'sha256:' + hashlib.sha256(content).hexdigest()
+    fetch_url(
+        http_server + '/video.mp4',
+        filepath,
+        checksum=checksum,
+        backoff=0,
+        chunk_size=64 * 1024,
+    )
+    assert open(filepath, 'rb').read() == content
+    assert not os.path.exists(filepath + '.part')
+
+    # the second and the third requests continue from the received bytes
+    assert 'Range' not in REQUESTS[0][1]
+    assert REQUESTS[1][1]['Range'] == f'bytes={len(content) // 2}-'
+    assert REQUESTS[2][1]['Range'].startswith('bytes=')
+
+
+def test_fetch_url_gives_up_and_verifies_checksum(http_server, tmp_path):
+    FILES['/audio.wav'] = b'x' * 1000
+    DROPS['/audio.wav'] = 10
+    filepath = str(tmp_path / 'audio.wav')
+    with pytest.raises(requests.exceptions.RequestException):
+        fetch_url(http_server + '/audio.wav', filepath, retries=2, backoff=0)
+    assert len(REQUESTS) == 3
+    # the partial file is kept for the next call
+    assert os.path.exists(filepath + '.part')
+
+    DROPS.clear()
+    with pytest.raises(ValueError):
+        fetch_url(http_server + '/audio.wav', filepath, checksum='md5:0000')
+    assert not os.path.exists(filepath)
+    assert not os.path.exists(filepath + '.part')
+
+    missing_path = str(tmp_path / 'missing.wav')
+    with open(missing_path + '.part', 'wb') as f:
+        f.write(b'x')
+    with pytest.raises(requests.HTTPError):
+        fetch_url(http_server + '/missing.wav', missing_path, backoff=0)
+    assert not os.path.exists(missing_path + '.part')
+
+
+def test_fetch_url_resumes_across_calls(http_server, tmp_path):
+    content = os.urandom(1024 * 1024)
+    FILES['/video.mp4'] = content
+    DROPS['/video.mp4'] = 1
+    filepath = str(tmp_path / 'video.mp4')
+    url = http_server + '/video.mp4'
+    with pytest.raises(requests.exceptions.RequestException):
+        fetch_url(url, filepath, retries=0, chunk_size=64 * 1024)
+    received = os.path.getsize(filepath + '.part')
+    assert received > 0
+
+    # the next call continues from the received bytes
+    fetch_url(url, filepath, retries=0, chunk_size=64 * 1024)
+    assert open(filepath, 'rb').read() == content
+    assert not os.path.exists(filepath + '.part')
+    assert not os.path.exists(filepath + '.part.validator')
+    assert REQUESTS[1][1]['Range'] == f'bytes={received}-'
+    assert REQUESTS[1][1]['If-Range'] == '"' + hashlib.md5(content).hexdigest() + '"'
+
+
+def test_download_cache_keeps_pinned_objects(http_server, tmp_path):
+    FILES['/a.png'] = b'a' * 1000
+    url = http_server + '/a.png'
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    download(url, str(tmp_path), cache=cache)
+
+    # a concurrent fetch between lookup and materialization
+    digest = cache._lookup(url, pin=True)[0]
+    cache.evict(max_size=0)
+    assert cache._lookup(url) is not None
+    cache._unpin(digest)
+    cache.evict(max_size=0)
+    assert cache._lookup(url) is None
+
+
+def test_download_failure_leaves_no_file(http_server, tmp_path):
+    url = http_server + '/images/late.jpg'
+    with pytest.raises(requests.HTTPError):
+        download(url, str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+    # the next export downloads the file instead of reusing an empty one
+    FILES['/images/late.jpg'] = b'late'
+    path = download(url, str(tmp_path))
+    assert path == str(tmp_path / 'late.jpg')
+    assert open(path, 'rb').read() == b'late'
+
+
+def test_resource_table_resolves_once(http_server, tmp_path):
+    FILES['/images/a.jpg'] = b'a'
+    FILES['/images/b.jpg'] = b'b'
+    urls = [http_server + f'/images/{name}.jpg' for name in 'abababab']
+    resources = ResourceTable()
+
+    def resolve(url):
+        return resources.resolve(url, download, str(tmp_path))
+
+    paths = [path for _, path in prefetch(urls, resolve, lookahead=4)]
+    assert len(set(paths)) == 2
+    assert len(resources) == 2
+    assert sorted(os.listdir(tmp_path)) == ['a.jpg', 'b.jpg']
+    assert len(REQUESTS) == 2
+
+
+def test_local_file_index(tmp_path, monkeypatch):
+    upload_dir = tmp_path / 'upload'
+    (upload_dir / '1').mkdir(parents=True)
+    (upload_dir / '1' / 'a b.jpg').write_bytes(b'a')
+    (tmp_path / 'local' / 'images').mkdir(parents=True)
+    (tmp_path / 'local' / 'images' / 'c.jpg').write_bytes(b'c')
+    index_file = str(tmp_path / 'index.json')
+
+    index = LocalFileIndex(
+        upload_dir=str(upload_dir), document_root=str(tmp_path), index_file=index_file
+    )
+    assert index.resolve('/data/upload/1/a%20b.jpg') == str(upload_dir / '1' / 'a b.jpg')
+    assert index.resolve('/data/local-files/?d=local/images/c.jpg') == str(
+        tmp_path / 'local' / 'images' / 'c.jpg'
+    )
+    assert index.resolve('http://example.com/a.jpg') is None
+    with pytest.raises(FileNotFoundError):
+        index.resolve('/data/upload/1/missing.jpg')
+    assert os.path.exists(index_file)
+
+    # the persisted index is used without listing the directories again
+    scanned = []
+    original_scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda p: scanned.append(p) or original_scandir(p))
+    index = LocalFileIndex(upload_dir=str(upload_dir), index_file=index_file)
+    output_dir = tmp_path / 'export'
+    output_dir.mkdir()
+    path = download(
+        '/data/upload/1/a%20b.jpg',
+        str(output_dir),
+        return_relative_path=True,
+        file_index=index,
+    )
+    assert path == os.path.join('export', 'a b.jpg')
+    assert scanned == []
+
+    # files added after the index was saved are still found
+    (upload_dir / '1' / 'new.jpg').write_bytes(b'n')
+    assert index.resolve('/data/upload/1/new.jpg') == str(upload_dir / '1' / 'new.jpg')
+
+
+def test_local_file_index_finds_new_files(tmp_path):
+    """Files created after their directory was listed are found, e.g. by a reused Converter"""
+    (tmp_path / '1').mkdir()
+    (tmp_path / '1' / 'a.png').write_bytes(b'a')
+    index = LocalFileIndex(upload_dir=str(tmp_path))
+    assert index.resolve('/data/upload/1/a.png') == str(tmp_path / '1' / 'a.png')
+
+    (tmp_path / '1' / 'b.png').write_bytes(b'b')
+    assert index.resolve('/data/upload/1/b.png') == str(tmp_path / '1' / 'b.png')
+    with pytest.raises(FileNotFoundError):
+        index.resolve('/data/upload/1/c.png')
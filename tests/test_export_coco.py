@@ -0,0 +1,302 @@
+import os
+import json
+
+from copy import deepcopy
+
+import numpy as np
+
+from label_studio_converter import Converter
+from label_studio_converter.brush import mask2rle
+
+
+BASE_DIR = os.path.dirname(__file__)
+IMAGE_PATH = os.path.join(BASE_DIR, 'test.png')
+LABEL_CONFIG = """
+<View>
+  <Image name="image" value="$image"/>
+  <RectangleLabels name="label" toName="image">
+    <Label value="Car"/>
+    <Label value="Person"/>
+  </RectangleLabels>
+</View>
+"""
+
+
+def rectangle(label, x=10, y=20, width=30, height=40):
+    return {
+        'from_name': 'label',
+        'to_name': 'image',
+        'type': 'rectanglelabels',
+        'original_width': 256,
+        'original_height': 256,
+        'value': {
+            'x': x,
+            'y': y,
+            'width': width,
+            'height': height,
+            'rectanglelabels': [label],
+        },
+    }
+
+
+def convert(tmp_path, tasks, config=LABEL_CONFIG, **kwargs):
+    input_file = str(tmp_path / 'tasks.json')
+    with open(input_file, 'w') as f:
+        json.dump(tasks, f)
+    output_dir = str(tmp_path / 'coco')
+    converter = Converter(config, str(tmp_path), **kwargs)
+    converter.convert_to_coco(input_file, output_dir, is_dir=False)
+    with open(os.path.join(output_dir, 'result.json')) as f:
+        return json.load(f)
+
+
+def test_convert_to_coco_deduplicates_images(tmp_path):
+    other_image = str(tmp_path / 'other.png')
+    with open(IMAGE_PATH, 'rb') as src, open(other_image, 'wb') as dst:
+        dst.write(src.read())
+
+    tasks = [
+        {
+            'id': 1,
+            'data': {'image': IMAGE_PATH},
+            'annotations': [
+                {'id': 1, 'result': [rectangle('Car')]},
+                {'id': 2, 'result': [rectangle('Person')]},
+            ],
+        },
+        {
+            'id': 2,
+            'data': {'image': other_image},
+            'annotations': [{'id': 3, 'result': [rectangle('Car')]}],
+        },
+        {
+            'id': 3,
+            'data': {'image': IMAGE_PATH},
+            'annotations': [{'id': 4, 'result': [rectangle('Car')]}],
+        },
+    ]
+    coco = convert(tmp_path, tasks, prefetch_size=2)
+
+    assert [image['file_name'] for image in coco['images']] == [IMAGE_PATH, other_image]
+    assert [image['id'] for image in coco['images']] == [0, 1]
+    assert [a['image_id'] for a in coco['annotations']] == [0, 0, 1, 0]
+    assert coco['annotations'][0]['bbox'] == [25.6, 51.2, 76.8, 102.4]
+
+
+def test_convert_to_coco_keeps_size_of_shared_image(tmp_path):
+    """Size of an image that can't be opened comes from the first result with original size"""
+    missing = str(tmp_path / 'missing.png')
+
+    def task(task_id, width=None):
+        result = [dict(rectangle('Car'), original_width=width, original_height=width)]
+        annotations = [{'id': task_id, 'result': result}] if width else []
+        return {'id': task_id, 'data': {'image': missing}, 'annotations': annotations}
+
+    coco = convert(tmp_path, [task(1), task(2, 100), task(3, 200)])
+
+    assert coco['images'] == [
+        {'width': 100, 'height': 100, 'id': 0, 'file_name': missing}
+    ]
+    assert [a['image_id'] for a in coco['annotations']] == [0, 0]
+    assert coco['annotations'][1]['bbox'] == [20.0, 40.0, 60.0, 80.0]
+
+
+def test_convert_to_coco_metadata_first(tmp_path, monkeypatch):
+    def probe_image(path):
+        raise AssertionError(f'{path} should not be opened')
+
+    monkeypatch.setattr(Converter, '_probe_image', staticmethod(probe_image))
+    missing_image = 'http://example.com/missing.png'
+    tasks = [
+        {
+            'id': 1,
+            'data': {'image': missing_image},
+            'annotations': [
+                {'id': 1, 'result': [rectangle('Car'), rectangle('Person')]}
+            ],
+        }
+    ]
+    coco = convert(
+        tmp_path, tasks, metadata_first=True, download_resources=False
+    )
+
+    assert [(i['width'], i['height']) for i in coco['images']] == [(256, 256)]
+    assert len(coco['annotations']) == 2
+
+
+def test_convert_to_coco_metadata_first_with_choices(tmp_path, monkeypatch):
+    """Results without the image size, like Choices, don't make regions inconsistent"""
+    probed = []
+    monkeypatch.setattr(Converter, '_probe_image', staticmethod(probed.append))
+    config = LABEL_CONFIG.replace(
+        '</View>',
+        '<Choices name="quality" toName="image"><Choice value="Good"/></Choices></View>',
+    )
+    choices = {
+        'from_name': 'quality',
+        'to_name': 'image',
+        'type': 'choices',
+        'value': {'choices': ['Good']},
+    }
+    tasks = [
+        {
+            'id': 1,
+            'data': {'image': 'http://example.com/missing.png'},
+            'annotations': [{'id': 1, 'result': [rectangle('Car'), choices]}],
+        }
+    ]
+    coco = convert(
+        tmp_path, tasks, config=config, metadata_first=True, download_resources=False
+    )
+
+    assert probed == []
+    assert [(i['width'], i['height']) for i in coco['images']] == [(256, 256)]
+    assert len(coco['annotations']) == 1
+
+
+def test_convert_to_coco_metadata_first_inconsistent_sizes(tmp_path):
+    other = rectangle('Person')
+    other['original_width'] = 512
+    tasks = [
+        {
+            'id': 1,
+            'data': {'image': IMAGE_PATH},
+            'annotations': [{'id': 1, 'result': [rectangle('Car'), other]}],
+        }
+    ]
+    coco = convert(tmp_path, tasks, metadata_first=True)
+
+    # regions don't agree, the size is read from the image
+    assert [(i['width'], i['height']) for i in coco['images']] == [(256, 256)]
+
+
+def test_convert_to_coco_brush(tmp_path):
+    config = """
+    <View>
+      <Image name="image" value="$image"/>
+      <BrushLabels name="label" toName="image">
+        <Label value="Car"/>
+      </BrushLabels>
+    </View>
+    """
+    mask = np.zeros((256, 256), dtype=np.uint8)
+    mask[10:20, 30:35] = 255
+    mask[15, 200] = 255
+    tasks = [
+        {
+            'id': 1,
+            'data': {'image': IMAGE_PATH},
+            'annotations': [
+                {
+                    'id': 1,
+                    'result': [
+                        {
+                            'from_name': 'label',
+                            'to_name': 'image',
+                            'type': 'brushlabels',
+                            'original_width': 256,
+                            'original_height': 256,
+                            'value': {
+                                'format': 'rle',
+                                'rle': mask2rle(mask),
+                                'brushlabels': ['Car'],
+                            },
+                        }
+                    ],
+                }
+            ],
+        }
+    ]
+    input_file = str(tmp_path / 'tasks.json')
+    with open(input_file, 'w') as f:
+        json.dump(tasks, f)
+    output_dir = str(tmp_path / 'coco')
+    converter = Converter(config, str(tmp_path))
+    assert 'COCO' in converter.supported_formats
+    converter.convert_to_coco(input_file, output_dir, is_dir=False)
+    with open(os.path.join(output_dir, 'result.json')) as f:
+        coco = json.load(f)
+
+    annotation = coco['annotations'][0]
+    assert annotation['area'] == 51
+    assert annotation['bbox'] == [30, 10, 171, 10]
+    assert annotation['iscrowd'] == 0
+    counts = annotation['segmentation']['counts']
+    assert annotation['segmentation']['size'] == [256, 256]
+    decoded = np.repeat(np.arange(len(counts)) % 2, counts).reshape(256, 256).T
+    assert (decoded * 255 == mask).all()
+
+
+def test_convert_to_coco_brush_scaled_to_image(tmp_path):
+    """Brush region drawn on a smaller image is decoded at original size and scaled to the image"""
+    config = """
+    <View>
+      <Image name="image" value="$image"/>
+      <BrushLabels name="label" toName="image">
+        <Label value="Car"/>
+      </BrushLabels>
+    </View>
+    """
+    mask = np.zeros((8, 8), dtype=np.uint8)
+    mask[2:4, 1:3] = 255
+    region = {
+        'from_name': 'label',
+        'to_name': 'image',
+        'type': 'brushlabels',
+        'original_width': 8,
+        'original_height': 8,
+        'value': {'format': 'rle', 'rle': mask2rle(mask), 'brushlabels': ['Car']},
+    }
+    # RLE doesn't match the original size
+    broken = deepcopy(region)
+    broken['original_width'] = 16
+    tasks = [
+        {
+            'id': 1,
+            'data': {'image': IMAGE_PATH},
+            'annotations': [{'id': 1, 'result': [region, broken]}],
+        }
+    ]
+    input_file = str(tmp_path / 'tasks.json')
+    with open(input_file, 'w') as f:
+        json.dump(tasks, f)
+    output_dir = str(tmp_path / 'coco')
+    Converter(config, str(tmp_path)).convert_to_coco(
+        input_file, output_dir, is_dir=False
+    )
+    with open(os.path.join(output_dir, 'result.json')) as f:
+        coco = json.load(f)
+
+    # test.png is 256x256, the mask is scaled 32 times
+    assert len(coco['annotations']) == 1
+    annotation = coco['annotations'][0]
+    assert annotation['segmentation']['size'] == [256, 256]
+    assert annotation['area'] == 64 * 64
+    assert annotation['bbox'] == [32, 64, 64, 64]
+    counts = annotation['segmentation']['counts']
+    decoded = np.repeat(np.arange(len(counts)) % 2, counts).reshape(256, 256).T
+    expected = np.kron(mask, np.ones((32, 32), dtype=np.uint8))
+    assert (decoded * 255 == expected).all()
+
+
+def test_get_labels_fills_free_category_ids():
+    schema = {
+        'label': {
+            'type': 'RectangleLabels',
+            'to_name': ['image'],
+            'inputs': [{'type': 'Image', 'value': 'image'}],
+            'labels': ['Car', 'Person', 'Bike', 'Tree'],
+            'labels_attrs': {'Car': {'category': 1}, 'Tree': {'category': 3}, 'Person': {}, 'Bike': {}},
+        }
+    }
+    converter = Converter(schema, project_dir=None)
+    categories, category_name_to_id = converter._get_labels()
+    assert category_name_to_id == {'Car': 1, 'Tree': 3, 'Bike': 0, 'Person': 2}
+    assert categories[-2:] == [{'id': 0, 'name': 'Bike'}, {'id': 2, 'name': 'Person'}]
+
+    # the map is computed once and callers get copies
+    categories[0]['name'] = 'Changed'
+    category_name_to_id['New'] = 4
+    assert converter._get_labels() == converter._get_labels()
+    assert 'New' not in converter._get_labels()[1]
+    assert converter._get_labels()[0][0]['name'] == 'Car'
@@ -1,4 +1,17 @@
+import json
+
 import label_studio_converter.utils as utils
+from label_studio_converter import Converter
+
+NER_CONFIG = '''
+<View>
+  <Labels name="label" toName="text">
+    <Label value="PER"/>
+    <Label value="LOC"/>
+  </Labels>
+  <Text name="text" value="$text"/>
+</View>
+'''
 
 
 def test_create_tokens_and_tags_with_eol_tag():
@@ -139,3 +152,72 @@ def test_create_tokens_and_tags_for_token_with_hash_sign():
         'O',
         'O',
     ]
+
+
+def test_create_tokens_and_tags_with_regex_tokenizers():
+    text = 'We gave  Jane Smith the ball.'
+    spans = [{'end': 19, 'labels': ['Person'], 'start': 9, 'text': 'Jane Smith'}]
+    tokens, tags = utils.create_tokens_and_tags(text, spans, tokenizer='whitespace')
+    assert tokens == ['We', 'gave', 'Jane', 'Smith', 'the', 'ball.']
+    assert tags == ['O', 'O', 'B-Person', 'I-Person', 'O', 'O']
+
+    tokens, tags = utils.create_tokens_and_tags(text, spans, tokenizer='wordpunct')
+    assert tokens == ['We', 'gave', 'Jane', 'Smith', 'the', 'ball', '.']
+    assert tags == ['O', 'O', 'B-Person', 'I-Person', 'O', 'O', 'O']
+
+
+def test_token_spans_are_cached():
+    utils.token_spans.cache_clear()
+    text = 'I need a break please'
+    assert utils.token_spans(text) is utils.token_spans(text)
+    assert utils.token_spans.cache_info().hits == 1
+    assert utils.token_spans(text, 'whitespace') == utils.token_spans(text)
+
+
+def test_create_tokens_and_tags_with_unsorted_and_overlapping_spans():
+    text = 'New York and Los Angeles are big cities'
+    spans = [
+        {'start': 13, 'end': 24, 'labels': ['LOC']},
+        {'start': 0, 'end': 8, 'labels': ['LOC']},
+        {'start': 4, 'end': 12, 'labels': ['MISC']},
+        {'start': 29, 'end': 32, 'labels': []},
+    ]
+    tokens, tags = utils.create_tokens_and_tags(text, spans)
+    assert tokens == ['New', 'York', 'and', 'Los', 'Angeles', 'are', 'big', 'cities']
+    assert tags == ['B-LOC', 'I-LOC', 'B-MISC', 'B-LOC', 'I-LOC', 'O', 'O', 'O']
+
+
+def test_convert_to_conll2003_parallel(tmp_path):
+    """Process pool mode writes the same file as serial mode"""
+    tasks = []
+    for i in range(150):
+        text = f'Task {i}: John Smith went to New York'
+        annotations = [{'id': i, 'result': []}]
+        if i % 3:
+            annotations[0]['result'] = [
+                {
+                    'id': 'a',
+                    'from_name': 'label',
+                    'to_name': 'text',
+                    'type': 'labels',
+                    'value': {'start': len(text) - 8, 'end': len(text), 'labels': ['LOC']},
+                }
+            ]
+        tasks.append({'id': i, 'data': {'text': text}, 'annotations': annotations})
+    input_file = tmp_path / 'tasks.json'
+    input_file.write_text(json.dumps(tasks))
+
+    outputs = []
+    for workers in (1, 3):
+        output_dir = tmp_path / f'conll_{workers}'
+        converter = Converter(NER_CONFIG, project_dir=None, workers=workers)
+        converter.convert_to_conll2003(
+            str(input_file), str(output_dir), is_dir=False, chunk_size=16
+        )
+        outputs.append((output_dir / 'result.conll').read_text())
+
+    assert outputs[0] == outputs[1]
+    lines = outputs[0].split('\n')
+    assert lines[0] == '-DOCSTART- -X- O'
+    assert lines[1:3] == ['Task -X- _ O', '0 -X- _ O']
+    assert 'New -X- _ B-LOC\nYork -X- _ I-LOC\n\nTask -X- _ O\n2 -X- _ O' in outputs[0]
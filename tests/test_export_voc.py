@@ -0,0 +1,47 @@
+import os
+import json
+
+from label_studio_converter import Converter
+from .test_export_yolo import rectangle
+from .utils import serve_directory
+
+
+BASE_DIR = os.path.dirname(__file__)
+LABEL_CONFIG = """
+<View>
+  <Image name="image" value="$image"/>
+  <RectangleLabels name="label" toName="image">
+    <Label value="Car"/>
+  </RectangleLabels>
+</View>
+"""
+
+
+def test_convert_to_voc_keeps_annotations_of_one_remote_image(tmp_path):
+    """Each annotation of the same remote image gets its own image copy and XML file"""
+    output_dir = str(tmp_path / 'voc')
+    input_file = str(tmp_path / 'tasks.json')
+    with serve_directory(BASE_DIR) as url:
+        tasks = [
+            {
+                'id': 1,
+                'data': {'image': url + '/test.png'},
+                'annotations': [
+                    {'id': i, 'completed_by': i, 'result': [rectangle(x)]}
+                    for i, x in enumerate([10, 50])
+                ],
+            }
+        ]
+        with open(input_file, 'w') as f:
+            json.dump(tasks, f)
+        Converter(LABEL_CONFIG, str(tmp_path)).convert_to_voc(
+            input_file, output_dir, is_dir=False
+        )
+
+    xmin = []
+    for name in sorted(os.listdir(os.path.join(output_dir, 'Annotations'))):
+        with open(os.path.join(output_dir, 'Annotations', name)) as f:
+            content = f.read()
+        xmin.append(int(content.split('<xmin>')[1].split('</xmin>')[0]))
+    assert sorted(xmin) == [25, 128]
+    assert len(os.listdir(os.path.join(output_dir, 'images'))) == 2
@@ -1,11 +1,15 @@
 import os
+import json
 import pytest
 import tempfile
 import shutil
 
+import numpy as np
+
 from label_studio_converter.utils import convert_annotation_to_yolo, convert_annotation_to_yolo_obb
 from label_studio_converter import Converter
-from .utils import almost_equal_1d, almost_equal_2d
+from label_studio_converter.brush import mask2rle
+from .utils import almost_equal_1d, almost_equal_2d, serve_directory
 
 
 BASE_DIR = os.path.dirname(__file__)
@@ -40,6 +44,24 @@ def check_equal_list_of_strings(list1, list2):
     return True
 
 
+def rectangle(x, label='Car'):
+    return {
+        'from_name': 'label',
+        'to_name': 'image',
+        'type': 'rectanglelabels',
+        'original_width': 256,
+        'original_height': 256,
+        'value': {
+            'x': x,
+            'y': 10,
+            'width': 20,
+            'height': 20,
+            'rotation': 0,
+            'rectanglelabels': [label],
+        },
+    }
+
+
 def get_os_walk(root_path):
     list_file_paths = []
     for root, dirs, files in os.walk(root_path):
@@ -429,3 +451,109 @@ def test_convert_invalid_annotation_to_yolo_obb_format():
     for idx, annotation in enumerate(annotations):
         result = convert_annotation_to_yolo_obb(annotation)
         assert result is None, f'Expected annotation for OBB at index {idx} to be invalid'
+
+
+def test_convert_to_yolo_skips_brush_regions(create_temp_folder):
+    """Brush regions can't be exported to YOLO, rectangles of the same task are still exported"""
+    config = """
+    <View>
+      <Image name="image" value="$image"/>
+      <RectangleLabels name="label" toName="image">
+        <Label value="Car"/>
+      </RectangleLabels>
+      <BrushLabels name="brush" toName="image">
+        <Label value="Car"/>
+      </BrushLabels>
+    </View>
+    """
+    mask = np.zeros((8, 8), dtype=np.uint8)
+    mask[2:4, 2:4] = 255
+    tasks = [
+        {
+            'id': 1,
+            'data': {'image': os.path.join(BASE_DIR, 'test.png')},
+            'annotations': [
+                {
+                    'id': 1,
+                    'result': [
+                        {
+                            'from_name': 'label',
+                            'to_name': 'image',
+                            'type': 'rectanglelabels',
+                            'original_width': 8,
+                            'original_height': 8,
+                            'value': {
+                                'x': 25,
+                                'y': 25,
+                                'width': 50,
+                                'height': 50,
+                                'rotation': 0,
+                                'rectanglelabels': ['Car'],
+                            },
+                        },
+                        {
+                            'from_name': 'brush',
+                            'to_name': 'image',
+                            'type': 'brushlabels',
+                            'original_width': 8,
+                            'original_height': 8,
+                            'value': {
+                                'format': 'rle',
+                                'rle': mask2rle(mask),
+                                'brushlabels': ['Car'],
+                            },
+                        },
+                    ],
+                }
+            ],
+        }
+    ]
+    input_file = os.path.join(create_temp_folder, 'tasks.json')
+    with open(input_file, 'w') as f:
+        json.dump(tasks, f)
+
+    output_dir = os.path.join(create_temp_folder, 'yolo')
+    converter = Converter(config, create_temp_folder)
+    converter.convert_to_yolo(input_file, output_dir, is_dir=False)
+
+    with open(os.path.join(output_dir, 'labels', 'test.txt')) as f:
+        lines = f.readlines()
+    assert lines == ['0 0.5 0.5 0.5 0.5\n']
+
+
+def test_convert_to_yolo_keeps_annotations_of_one_remote_image(create_temp_folder):
+    """Each annotation of the same remote image gets its own image copy and label file"""
+    config = """
+    <View>
+      <Image name="image" value="$image"/>
+      <RectangleLabels name="label" toName="image">
+        <Label value="Car"/>
+      </RectangleLabels>
+    </View>
+    """
+    output_dir = os.path.join(create_temp_folder, 'yolo')
+    input_file = os.path.join(create_temp_folder, 'tasks.json')
+    with serve_directory(BASE_DIR) as url:
+        tasks = [
+            {
+                'id': 1,
+                'data': {'image': url + '/test.png'},
+                'annotations': [
+                    {'id': i, 'completed_by': i, 'result': [rectangle(x)]}
+                    for i, x in enumerate([10, 30, 50])
+                ],
+            }
+        ]
+        with open(input_file, 'w') as f:
+            json.dump(tasks, f)
+        Converter(config, create_temp_folder).convert_to_yolo(
+            input_file, output_dir, is_dir=False
+        )
+
+    labels = []
+    for name in sorted(os.listdir(os.path.join(output_dir, 'labels'))):
+        with open(os.path.join(output_dir, 'labels', name)) as f:
+            labels.append(f.read())
+    assert len(labels) == 3
+    assert sorted(float(label.split()[1]) for label in labels) == [0.2, 0.4, 0.6]
+    assert len(os.listdir(os.path.join(output_dir, 'images'))) == 3
@@ -0,0 +1,99 @@
+"""
+Test for the image_probe.py module
+"""
+import os
+import pytest
+
+from PIL import Image
+
+from label_studio_converter.cache import ImageMetaCache
+from label_studio_converter.image_probe import probe_image
+from label_studio_converter.utils import get_image_size, get_image_size_and_channels
+
+
+FORMATS = [
+    ('jpg', 'JPEG', 'RGB', {}),
+    ('jpg', 'JPEG', 'L', {'progressive': True}),
+    ('jpg', 'JPEG', 'CMYK', {}),
+    ('png', 'PNG', 'RGB', {}),
+    ('png', 'PNG', 'RGBA', {}),
+    ('png', 'PNG', 'L', {}),
+    ('png', 'PNG', 'LA', {}),
+    ('png', 'PNG', 'P', {}),
+    ('png', 'PNG', '1', {}),
+    ('gif', 'GIF', 'P', {}),
+    ('bmp', 'BMP', 'RGB', {}),
+    ('bmp', 'BMP', 'L', {}),
+    ('bmp', 'BMP', 'RGBA', {}),
+    ('webp', 'WEBP', 'RGB', {}),
+    ('webp', 'WEBP', 'RGBA', {}),
+    ('webp', 'WEBP', 'RGB', {'lossless': True}),
+    ('webp', 'WEBP', 'RGBA', {'lossless': True}),
+    ('tif', 'TIFF', 'RGB', {}),
+    ('tif', 'TIFF', 'RGBA', {'compression': 'tiff_lzw'}),
+    ('tif', 'TIFF', 'L', {}),
+    ('tif', 'TIFF', 'CMYK', {}),
+    ('ico', 'ICO', 'RGBA', {}),
+]
+
+
+@pytest.mark.parametrize('ext, fmt, mode, params', FORMATS)
+def test_probe_image_matches_pil(tmp_path, ext, fmt, mode, params):
+    path = str(tmp_path / f'image.{ext}')
+    size = (37, 21) if fmt != 'ICO' else (32, 32)
+    Image.new(mode, size).save(path, fmt, **params)
+
+    with Image.open(path) as image:
+        expected = image.size + (len(image.getbands()),)
+    assert probe_image(path) == expected
+    assert get_image_size_and_channels(path) == expected
+    assert get_image_size(path) == expected[:2]
+
+
+def test_probe_image_with_exif(tmp_path):
+    path = str(tmp_path / 'exif.jpg')
+    exif = Image.Exif()
+    exif[0x010E] = 'x' * 10000  # image description makes APP1 segment long
+    Image.new('RGB', (640, 329)).save(path, 'JPEG', exif=exif)
+    assert probe_image(path) == (640, 329, 3)
+
+
+def test_probe_image_truncated(tmp_path):
+    path = str(tmp_path / 'broken.png')
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+    with pytest.raises(Exception):
+        probe_image(path)
+
+
+def test_probe_dataset_images():
+    images_dir = os.path.join(
+        os.path.dirname(__file__), 'data', 'test_import_yolo_data', 'images'
+    )
+    for name in os.listdir(images_dir):
+        path = os.path.join(images_dir, name)
+        with Image.open(path) as image:
+            assert probe_image(path) == image.size + (len(image.getbands()),)
+
+
+def test_image_meta_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / 'image.png')
+    Image.new('RGB', (37, 21)).save(path)
+    db_path = str(tmp_path / 'meta.sqlite3')
+    assert ImageMetaCache(db_path).probe(path) == (37, 21, 3)
+
+    # the next run reads metadata from the database
+    calls = []
+    monkeypatch.setattr(
+        'label_studio_converter.cache.probe_image',
+        lambda p: calls.append(p) or probe_image(p),
+    )
+    cache = ImageMetaCache(db_path)
+    assert cache.probe(path) == (37, 21, 3)
+    assert calls == []
+
+    # changed file is probed again
+    Image.new('RGBA', (50, 60)).save(path)
+    os.utime(path, ns=(0, 0))
+    assert cache.probe(path) == (50, 60, 4)
+    assert len(calls) == 1
@@ -0,0 +1,120 @@
+import json
+
+import numpy as np
+
+from label_studio_converter import brush
+from label_studio_converter.imports import coco as import_coco
+
+
+COCO = {
+    'categories': [
+        {'id': 2, 'name': 'Person'},
+        {'id': 1, 'name': 'Car'},
+    ],
+    'images': [
+        {'id': 3, 'file_name': 'c.jpg', 'width': 200, 'height': 100},
+        {'id': 1, 'file_name': 'a.jpg', 'width': 100, 'height': 50},
+        {'id': 2, 'file_name': 'b.jpg', 'width': 100, 'height': 50},
+    ],
+    'annotations': [
+        {'id': 1, 'image_id': 3, 'category_id': 1, 'bbox': [20, 10, 40, 20]},
+        {'id': 2, 'image_id': 1, 'category_id': 2, 'bbox': [10, 5, 10, 5]},
+        {
+            'id': 3,
+            'image_id': 3,
+            'category_id': 2,
+            'bbox': [0, 0, 10, 10],
+            'segmentation': [[0, 0, 10, 0, 10, 10]],
+        },
+        {'id': 4, 'image_id': 1, 'category_id': 1, 'bbox': [50, 25, 50, 25]},
+    ],
+}
+
+
+def convert(tmp_path, **kwargs):
+    input_file = str(tmp_path / 'coco.json')
+    with open(input_file, 'w') as f:
+        json.dump(COCO, f)
+    out_file = str(tmp_path / 'tasks.json')
+    import_coco.convert_coco_to_ls(input_file, out_file, **kwargs)
+    with open(out_file) as f:
+        tasks = json.load(f)
+    for task in tasks:
+        for result in task['annotations'][0]['result']:
+            result.pop('id')
+    return tasks
+
+
+def test_import_coco(tmp_path):
+    tasks = convert(tmp_path)
+
+    # tasks are sorted by image id, results keep the order of annotations
+    assert [task['data']['image'] for task in tasks] == [
+        '/data/local-files/?d=/a.jpg',
+        '/data/local-files/?d=/b.jpg',
+        '/data/local-files/?d=/c.jpg',
+    ]
+    results = [task['annotations'][0]['result'] for task in tasks]
+    assert [r['value']['rectanglelabels'] for r in results[0]] == [['Person'], ['Car']]
+    assert results[0][1]['value']['x'] == 50.0
+    assert results[1] == []
+    assert [r['type'] for r in results[2]] == [
+        'rectanglelabels',
+        'rectanglelabels',
+        'polygonlabels',
+    ]
+
+
+def test_import_coco_spills_annotations(tmp_path):
+    assert convert(tmp_path, max_in_memory=1) == convert(tmp_path)
+
+
+def test_import_coco_jsonl_label_config(tmp_path):
+    input_file = str(tmp_path / 'coco.json')
+    with open(input_file, 'w') as f:
+        json.dump(COCO, f)
+    import_coco.convert_coco_to_ls(
+        input_file, str(tmp_path / 'tasks.jsonl'), out_format='jsonl'
+    )
+    assert (tmp_path / 'tasks.label_config.xml').exists()
+    with open(tmp_path / 'tasks.jsonl') as f:
+        assert len(f.readlines()) == 3
+
+
+def test_import_coco_rle(tmp_path):
+    mask = np.zeros((5, 6), dtype=np.uint8)
+    mask[1:4, 2:5] = 255
+    mask[0, 0] = 255
+    # column-major runs starting with background
+    counts = [0, 1, 10, 3, 2, 3, 2, 3, 6]
+    COCO['annotations'] += [
+        {
+            'id': 5,
+            'image_id': 2,
+            'category_id': 1,
+            'iscrowd': 1,
+            'segmentation': {'size': [5, 6], 'counts': '01:2H0004'},
+        },
+        {
+            'id': 6,
+            'image_id': 2,
+            'category_id': 2,
+            'iscrowd': 1,
+            'segmentation': {'size': [5, 6], 'counts': counts},
+        },
+    ]
+    try:
+        tasks = convert(tmp_path)
+    finally:
+        del COCO['annotations'][-2:]
+
+    results = tasks[1]['annotations'][0]['result']
+    assert [r['type'] for r in results] == ['brushlabels', 'brushlabels']
+    assert [r['value']['brushlabels'] for r in results] == [['Car'], ['Person']]
+    for result in results:
+        image = brush.decode_rle(result['value']['rle']).reshape(5, 6, 4)
+        assert (image[:, :, 3] == mask).all()
+        assert result['value']['rle'] == brush.mask2rle(mask)
+
+    config = (tmp_path / 'tasks.label_config.xml').read_text()
+    assert '<BrushLabels name="label_brush"' in config
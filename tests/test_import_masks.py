@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+import pytest
+
+from PIL import Image
+
+from label_studio_converter.brush import decode_rle_channel
+from label_studio_converter.imports import masks as import_masks
+
+
+def decode(result):
+    value = result['value']
+    return decode_rle_channel(value['rle']).reshape(
+        result['original_height'], result['original_width']
+    )
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_import_indexed_masks(tmp_path, workers):
+    masks_dir = tmp_path / 'masks'
+    (masks_dir / 'sub').mkdir(parents=True)
+    first = np.zeros((6, 8), dtype=np.uint8)
+    first[1:3, 1:4] = 1
+    first[4:6, 5:8] = 2
+    second = np.zeros((5, 4), dtype=np.uint8)
+    second[2:4, :] = 2
+    Image.fromarray(first).save(masks_dir / 'a.png')
+    Image.fromarray(second).save(masks_dir / 'sub' / 'b.png')
+    label_map = tmp_path / 'labels.json'
+    label_map.write_text(json.dumps({'Car': 1, 'Airplane': 2}))
+
+    out_file = str(tmp_path / 'tasks.json')
+    import_masks.convert_masks_to_ls(
+        str(masks_dir),
+        out_file,
+        label_map=str(label_map),
+        out_type='predictions',
+        model_version='v1',
+        image_ext='.jpg',
+        workers=workers,
+    )
+    with open(out_file) as f:
+        tasks = json.load(f)
+
+    assert [task['data']['image'] for task in tasks] == [
+        '/data/local-files/?d=a.jpg',
+        '/data/local-files/?d=sub/b.jpg',
+    ]
+    results = tasks[0]['predictions'][0]['result']
+    assert tasks[0]['predictions'][0]['model_version'] == 'v1'
+    assert [r['value']['brushlabels'] for r in results] == [['Car'], ['Airplane']]
+    assert (decode(results[0]) == (first == 1) * 255).all()
+    assert (decode(results[1]) == (first == 2) * 255).all()
+
+    results = tasks[1]['predictions'][0]['result']
+    assert [r['value']['brushlabels'] for r in results] == [['Airplane']]
+    assert (decode(results[0]) == (second == 2) * 255).all()
+
+
+def test_import_binary_masks(tmp_path):
+    mask = np.zeros((4, 4), dtype=np.uint8)
+    mask[1:3, 1:3] = 200
+    Image.fromarray(mask).save(tmp_path / 'mask.png')
+
+    out_file = str(tmp_path / 'out' / 'tasks.json')
+    (tmp_path / 'out').mkdir()
+    import_masks.convert_masks_to_ls(str(tmp_path), out_file, label='Cell')
+    with open(out_file) as f:
+        tasks = json.load(f)
+
+    result = tasks[0]['annotations'][0]['result'][0]
+    assert result['value']['brushlabels'] == ['Cell']
+    assert (decode(result) == (mask > 128) * 255).all()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_import_masks_skips_broken_files(tmp_path, workers):
+    masks_dir = tmp_path / 'masks'
+    masks_dir.mkdir()
+    mask = np.zeros((4, 4), dtype=np.uint8)
+    mask[1:3, 1:3] = 1
+    Image.fromarray(mask).save(masks_dir / 'a.png')
+    Image.fromarray(np.zeros((4, 4, 3), dtype=np.uint8)).save(masks_dir / 'b.png')
+    (masks_dir / 'c.png').write_bytes(b'not an image')
+
+    out_file = str(tmp_path / 'tasks.json')
+    import_masks.convert_masks_to_ls(
+        str(masks_dir), out_file, label_map={'Car': 1}, workers=workers
+    )
+    with open(out_file) as f:
+        tasks = json.load(f)
+
+    assert [task['data']['image'] for task in tasks] == ['/data/local-files/?d=a.png']
+    result = tasks[0]['annotations'][0]['result'][0]
+    assert (decode(result) == (mask == 1) * 255).all()
@@ -84,3 +84,28 @@ def test_base_import_yolo_with_img_dims():
         ls_data = json.loads(f.read())
 
     assert len(ls_data) == len(img_files), "some file imports did not succeed!"
+
+
+def test_import_yolo_parallel(tmp_path):
+    """Process pool mode produces the same tasks in the same order as serial mode"""
+    input_data_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data', 'test_import_yolo_data')
+
+    results = []
+    for workers in (1, 2):
+        out_json_file = str(tmp_path / f'yolo_{workers}.json')
+        import_yolo.convert_yolo_to_ls(
+            input_dir=input_data_dir,
+            out_file=out_json_file,
+            image_ext='.jpg,.jpeg,.png',
+            workers=workers,
+            image_meta_cache=str(tmp_path / 'meta.sqlite3'),
+        )
+        with open(out_json_file) as f:
+            tasks = json.load(f)
+        for task in tasks:
+            for result in task.get('annotations', [{}])[0].get('result', []):
+                result.pop('id')
+        results.append(tasks)
+
+    assert results[0] == results[1]
+    assert any(task.get('annotations') for task in results[0])
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from label_studio_converter.imports import pathtrack
+from label_studio_converter.imports.task_writer import TaskWriter
+
+
+TASKS = [{'data': {'image': f'{i}.jpg', 'text': 'ünïcode'}} for i in range(7)]
+
+
+def test_single_json_file(tmp_path):
+    out_file = str(tmp_path / 'tasks.json')
+    with TaskWriter(out_file) as writer:
+        for task in TASKS:
+            writer.write(task)
+
+    with open(out_file) as f:
+        assert f.read() == json.dumps(TASKS)
+    assert writer.files == [out_file]
+    assert not (tmp_path / 'tasks.manifest.json').exists()
+
+
+def test_no_tasks(tmp_path):
+    out_file = str(tmp_path / 'tasks.json')
+    with TaskWriter(out_file) as writer:
+        pass
+    assert writer.count == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    'out_format, shard_size, shard_bytes, sizes',
+    [
+        ('json', 3, None, [3, 3, 1]),
+        ('jsonl', 3, None, [3, 3, 1]),
+        ('json', None, 150, [2, 2, 2, 1]),
+        ('json', None, 1, [1] * 7),
+    ],
+)
+def test_shards(tmp_path, out_format, shard_size, shard_bytes, sizes):
+    out_file = str(tmp_path / 'tasks.json')
+    with TaskWriter(out_file, out_format, shard_size, shard_bytes) as writer:
+        for task in TASKS:
+            writer.write(task)
+
+    with open(tmp_path / 'tasks.manifest.json') as f:
+        manifest = json.load(f)
+    assert manifest['tasks'] == len(TASKS)
+    assert [shard['tasks'] for shard in manifest['shards']] == sizes
+    assert manifest['shards'][0]['file'] == f'tasks-00000.{out_format}'
+
+    tasks = []
+    for shard in manifest['shards']:
+        path = tmp_path / shard['file']
+        assert path.stat().st_size == shard['bytes']
+        if shard_bytes and shard['tasks'] > 1:
+            assert shard['bytes'] <= shard_bytes
+        with open(path) as f:
+            if out_format == 'jsonl':
+                tasks += [json.loads(line) for line in f]
+            else:
+                tasks += json.load(f)
+    assert tasks == TASKS
+
+
+def test_jsonl_extension(tmp_path):
+    out_file = str(tmp_path / 'tasks.json')
+    with TaskWriter(out_file, 'jsonl') as writer:
+        for task in TASKS:
+            writer.write(task)
+
+    assert writer.out_file == str(tmp_path / 'tasks.jsonl')
+    assert writer.files == [writer.out_file]
+    assert not (tmp_path / 'tasks.json').exists()
+    with open(writer.out_file) as f:
+        assert [json.loads(line) for line in f] == TASKS
+
+
+@pytest.mark.parametrize(
+    'out_format, shard_size, content',
+    [('json', None, '[]'), ('jsonl', None, ''), ('json', 3, '[]')],
+)
+def test_write_empty(tmp_path, out_format, shard_size, content):
+    out_file = str(tmp_path / 'tasks.json')
+    with TaskWriter(out_file, out_format, shard_size, write_empty=True) as writer:
+        pass
+
+    assert len(writer.files) == 1
+    with open(writer.files[0]) as f:
+        assert f.read() == content
+    if shard_size:
+        with open(tmp_path / 'tasks.manifest.json') as f:
+            assert json.load(f)['tasks'] == 0
+
+
+@pytest.mark.parametrize('out_format, content', [('json', '[]'), ('jsonl', '')])
+def test_pathtrack_without_shots(tmp_path, out_format, content):
+    """PathTrack conversion writes the output file when there are no tasks"""
+    pathtrack.convert_dataset(
+        str(tmp_path), 'https://example.com/', target_fps=30, out_format=out_format
+    )
+    with open(tmp_path / f'import-30.{out_format}') as f:
+        assert f.read() == content
@@ -1,4 +1,8 @@
 import math
+import functools
+import threading
+import http.server
+import contextlib
 
 
 def almost_equal_1d(a, b, tol=1e-9):
@@ -7,4 +11,19 @@ def almost_equal_1d(a, b, tol=1e-9):
 def almost_equal_2d(a, b, tol=1e-9):
     a = [z for x in a for z in x]
     b = [z for x in b for z in x]
-    return all(math.isclose(x, y, abs_tol=tol) for x, y in zip(a, b))
\ No newline at end of file
+    return all(math.isclose(x, y, abs_tol=tol) for x, y in zip(a, b))
+
+
+@contextlib.contextmanager
+def serve_directory(path):
+    """Serve files of directory over HTTP, yield the root url"""
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=path)
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()